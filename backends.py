@@ -0,0 +1,246 @@
+import abc
+import io
+import json
+import os
+import sys
+import time
+import draw
+import files
+import qr
+import raster
+
+class Backend(abc.ABC):
+	"""One implementation of the hot stages of building a symbol.
+
+	A backend computes the interleaved error correction codewords, scores the
+	unmasked symbol under every mask, and renders finished symbols. Every backend
+	must give byte-identical results to ReferenceBackend, which check_backends
+	verifies.
+	"""
+	name = None
+
+	def is_available(self):
+		return True
+
+	@abc.abstractmethod
+	def error_correction(self, data, error_level="L", version=1):
+		pass
+
+	# the error correction of several messages of the same version and level at once
+	def error_correction_many(self, data, error_level="L", version=1):
+		return [self.error_correction(d, error_level=error_level, version=version) for d in data]
+
+	# penalty score of the unmasked symbol under each of draw.MASKS
+	@abc.abstractmethod
+	def mask_scores(self, matrix):
+		pass
+
+	def render(self, matrix, f, format="png", scale=4, border=4):
+		if format not in raster.WRITERS:
+			raise ValueError("unknown image format %r" % format)
+		raster.WRITERS[format](matrix, f, scale=scale, border=border)
+
+class ReferenceBackend(Backend):
+	"""The pure python implementation in qr.py, draw.py and raster.py."""
+	name = "reference"
+
+	def error_correction(self, data, error_level="L", version=1):
+		return qr.error_correction(data, error_level=error_level, version=version)
+
+	def mask_scores(self, matrix):
+		return draw.get_mask_scores(matrix)
+
+# numpy_backend once looked for, or False if numpy isn't installed. importing numpy
+# takes longer than building a small symbol, so it waits until the backend is used
+_numpy_backend = None
+
+def get_numpy_backend():
+	global _numpy_backend
+	if _numpy_backend is None:
+		try:
+			import numpy_backend
+			_numpy_backend = numpy_backend
+		except ImportError:
+			_numpy_backend = False
+	return _numpy_backend
+
+class NumpyBackend(Backend):
+	"""Whole-array versions of the same stages, from numpy_backend.py."""
+	name = "numpy"
+
+	def is_available(self):
+		return bool(get_numpy_backend())
+
+	def error_correction(self, data, error_level="L", version=1):
+		return self.error_correction_many([data], error_level=error_level, version=version)[0]
+
+	def error_correction_many(self, data, error_level="L", version=1):
+		codewords = get_numpy_backend().error_correction_many(data, error_level=error_level, version=version)
+		return [row.tobytes() for row in codewords]
+
+	def mask_scores(self, matrix):
+		numpy_backend = get_numpy_backend()
+		return numpy_backend.penalty_scores(numpy_backend.masked_candidates(matrix))
+
+	def render(self, matrix, f, format="png", scale=4, border=4):
+		width = raster.get_image_size(matrix, scale, border)
+		if format == "pbm":
+			f.write(b"P4\n%d %d\n" % (width, width))
+			f.write(get_numpy_backend().get_packed_image(matrix, scale, border))
+		elif format == "pgm":
+			f.write(b"P5\n%d %d\n255\n" % (width, width))
+			f.write(get_numpy_backend().get_gray_image(matrix, scale, border))
+		else:
+			Backend.render(self, matrix, f, format, scale, border)
+
+BACKENDS = {}
+
+def register(backend):
+	BACKENDS[backend.name] = backend
+
+register(ReferenceBackend())
+register(NumpyBackend())
+
+# what backend=None means everywhere. numpy is faster at every version, but
+# importing it takes longer (about 110ms) than it saves on any one symbol (1ms at
+# version 1, 45ms at version 40), so it is only the default once something has
+# loaded it with get_numpy_backend, as code about to build many symbols does
+def get_default_name():
+	return "numpy" if _numpy_backend else "reference"
+
+def get_available():
+	return [backend for backend in BACKENDS.values() if backend.is_available()]
+
+# where the auto calibration is kept between runs
+def get_calibration_path():
+	path = os.environ.get("QR_BACKEND_CACHE")
+	if path is None:
+		path = os.path.join(os.path.expanduser("~"), ".cache", "qr", "backends.json")
+	return path
+
+# the calibration only holds for the same interpreter and set of backends
+def get_calibration_key():
+	return {"python": sys.version, "backends": sorted(backend.name for backend in get_available())}
+
+# times every available backend on a full symbol from the middle of each of
+# qr.VERSION_RANGES, and returns the fastest per range as {"first-last": name}
+def calibrate(repeat=3):
+	choices = {}
+	for (first, last) in qr.VERSION_RANGES:
+		version = (first + last) // 2
+		msg = "A" * qr.MAX_CHAR_COUNTS["M"][version-1]
+		timings = {}
+		for backend in get_available():
+			qr.make_qr(msg, error_level="M", version=version, backend=backend.name) # warm the caches
+			best = None
+			for _ in range(repeat):
+				start = time.perf_counter()
+				qr.make_qr(msg, error_level="M", version=version, backend=backend.name)
+				elapsed = time.perf_counter() - start
+				best = elapsed if best is None else min(best, elapsed)
+			timings[backend.name] = best
+		choices["%d-%d" % (first, last)] = min(timings, key=timings.get)
+	return choices
+
+_auto_choices = None
+
+# the calibration from disk, or a fresh one that is then saved for next time
+def get_auto_choices():
+	global _auto_choices
+	if _auto_choices is not None:
+		return _auto_choices
+	try:
+		with open(get_calibration_path()) as f:
+			saved = json.load(f)
+		if saved.get("key") == get_calibration_key():
+			_auto_choices = saved["choices"]
+			return _auto_choices
+	except (OSError, ValueError, KeyError):
+		pass
+
+	_auto_choices = calibrate()
+	try:
+		save_calibration(_auto_choices)
+	except OSError:
+		pass # an unwritable cache only means calibrating again next run
+	return _auto_choices
+
+def save_calibration(choices):
+	path = get_calibration_path()
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	files.replace_file(path, json.dumps({"key": get_calibration_key(), "choices": choices}, indent=2))
+
+# the backend called name, for "auto" the fastest one for this version, and for
+# None the one get_default_name gives
+def get_backend(name="auto", version=1):
+	if name is None:
+		name = get_default_name()
+	elif name == "auto":
+		for (first, last) in qr.VERSION_RANGES:
+			if first <= version <= last:
+				name = get_auto_choices()["%d-%d" % (first, last)]
+	if name not in BACKENDS:
+		raise ValueError("unknown backend %r" % name)
+	backend = BACKENDS[name]
+	if not backend.is_available():
+		raise ValueError("backend %r is not available" % name)
+	return backend
+
+def render_bytes(backend, matrix, format):
+	f = io.BytesIO()
+	backend.render(matrix, f, format, scale=3, border=4)
+	return f.getvalue()
+
+def get_test_messages():
+	messages = ["", "0", "HELLO WORLD", "https://example.com/p/0123456789?s=ab", "été € 42"]
+	for version in (1, 7, 10, 27, qr.MAX_VERSION):
+		for level in "LMQH":
+			messages.append("A1b" * (qr.MAX_CHAR_COUNTS[level][version-1] // 5))
+	return messages
+
+# differential check of every available backend against the reference: the
+# finished matrices and pbm and pgm renders must be byte-identical. raises
+# AssertionError listing every mismatch, and returns the number of cases checked
+def check_backends(messages=None, levels="LMQH"):
+	if messages is None:
+		messages = get_test_messages()
+	reference = BACKENDS["reference"]
+	mismatches = []
+	cases = 0
+	for msg in messages:
+		for level in levels:
+			try:
+				expected = qr.make_qr(msg, error_level=level, backend="reference")
+			except RuntimeError:
+				continue # too long for this level
+			for backend in get_available():
+				cases += 1
+				symbol = qr.make_qr(msg, error_level=level, backend=backend.name)
+				if symbol.modules != expected.modules:
+					mismatches.append("%s: matrix differs for %r at %s" % (backend.name, msg[:20], level))
+				for format in ("pbm", "pgm"):
+					if render_bytes(reference, expected, format) != render_bytes(backend, symbol, format):
+						mismatches.append("%s: %s differs for %r at %s" % (backend.name, format, msg[:20], level))
+	if mismatches:
+		raise AssertionError("\n".join(mismatches))
+	return cases
+
+def main():
+	global _auto_choices
+	import argparse
+	parser = argparse.ArgumentParser(description="check or calibrate the qr backends")
+	parser.add_argument("--check", action="store_true", help="compare every backend against the reference")
+	parser.add_argument("--calibrate", action="store_true", help="time the backends again and save the choices")
+	args = parser.parse_args()
+
+	print("available: %s" % ", ".join(backend.name for backend in get_available()))
+	if args.check:
+		print("%d cases match the reference" % check_backends())
+	if args.calibrate:
+		_auto_choices = calibrate()
+		save_calibration(_auto_choices)
+	for (versions, name) in get_auto_choices().items():
+		print("versions %s: %s" % (versions, name))
+
+if __name__ == "__main__":
+	main()
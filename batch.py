@@ -0,0 +1,92 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby, islice
+import backends
+import draw
+import qr
+
+# splits an iterable of messages into lists of at most chunk_size
+def chunked(messages, chunk_size):
+	messages = iter(messages)
+	while True:
+		chunk = list(islice(messages, chunk_size))
+		if not chunk:
+			return
+		yield chunk
+
+# each message is either a string, encoded at the default error level, or a
+# (message, error_level) pair
+def split_request(message, error_level):
+	if isinstance(message, str):
+		return (message, error_level)
+	return message
+
+# encodes one chunk, grouped by (version, error level) so that symbols sharing a
+# template and generator polynomial are built back to back, and returns the
+# symbols in the original order. the error correction codewords of each group
+# are computed together, which the numpy backend does in one pass
+def generate_chunk(chunk, error_level="M"):
+	requests = [split_request(message, error_level) for message in chunk]
+	backends.get_numpy_backend() # worth importing for a whole chunk, if it is installed
+	keys = [(qr.get_version(msg, error_level=level), level) for (msg, level) in requests]
+
+	results = [None] * len(requests)
+	order = sorted(range(len(requests)), key=lambda i: keys[i])
+	for ((version, level), group) in groupby(order, key=lambda i: keys[i]):
+		group = list(group)
+		engine = backends.get_backend(None, version)
+		data = [qr.get_formatted_data(requests[i][0], version=version, error_level=level) for i in group]
+		codewords = engine.error_correction_many(data, error_level=level, version=version)
+		for (i, row) in zip(group, codewords):
+			results[i] = draw.generate_qr(version, row, error_level=level, mask_scores=engine.mask_scores)
+	return results
+
+def generate_many(messages, error_level="M", workers=None, chunk_size=256, max_pending=None):
+	"""Encodes every message and yields the symbols as draw.QRMatrix, in input order.
+
+	Messages are read lazily and sent to a pool of `workers` processes (all cores
+	by default) in chunks of `chunk_size`. At most `max_pending` chunks (twice the
+	worker count by default) are in flight at once, so memory stays bounded no
+	matter how long the input is. With workers=1 everything runs in this process.
+	"""
+	if workers is None:
+		workers = os.cpu_count() or 1
+
+	if workers == 1:
+		for chunk in chunked(messages, chunk_size):
+			yield from generate_chunk(chunk, error_level)
+		return
+
+	if max_pending is None:
+		max_pending = workers * 2
+	with ProcessPoolExecutor(max_workers=workers) as pool:
+		pending = deque()
+		for chunk in chunked(messages, chunk_size):
+			if len(pending) >= max_pending:
+				yield from pending.popleft().result()
+			pending.append(pool.submit(generate_chunk, chunk, error_level))
+		while pending:
+			yield from pending.popleft().result()
+
+def generate_structured_append(msg, error_level="M", mode=None, max_symbols=16, workers=None):
+	"""Encodes a message too long for one symbol as a structured append set.
+
+	The message is split into at most `max_symbols` parts that all fit the same,
+	smallest possible version, and the symbols are built on a pool of `workers`
+	processes. Returns the symbols as a list in sequence order.
+	"""
+	(version, parts) = qr.split_structured_append(msg, error_level=error_level, mode=mode, max_parts=max_symbols)
+	parity = qr.get_structured_append_parity(msg)
+	requests = [
+		(part, error_level, mode, version, "exhaustive", (index, len(parts), parity))
+		for (index, part) in enumerate(parts)
+	]
+
+	if workers is None:
+		workers = os.cpu_count() or 1
+	workers = min(workers, len(parts))
+	if workers == 1:
+		return [qr.make_qr(*request) for request in requests]
+	with ProcessPoolExecutor(max_workers=workers) as pool:
+		return list(pool.map(qr.make_qr, *zip(*requests)))
@@ -0,0 +1,199 @@
+import argparse
+import io
+import json
+import random
+import sys
+import time
+import tracemalloc
+import draw
+import qr
+import raster
+
+STAGES = ["get_version", "get_formatted_data", "error_correction", "base", "insert_data",
+	"apply_mask", "get_penalty_score", "render"]
+
+# characters payloads of each shape are drawn from. byte payloads are the worst
+# case (8 bits a character), mixed ones look like typical product urls
+SHAPES = {
+	"numeric": "0123456789",
+	"alphanumeric": "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:",
+	"byte": "abcdefghijklmnopqrstuvwxyz!#&()=?@[]_~",
+	"mixed": None,
+}
+
+def get_source_text(shape, seed=0):
+	rng = random.Random(seed)
+	if SHAPES[shape] is not None:
+		return "".join(rng.choice(SHAPES[shape]) for _ in range(8000))
+	parts = []
+	while sum(map(len, parts)) < 8000:
+		parts.append("https://example.com/p/")
+		parts.append("".join(rng.choice(SHAPES["numeric"]) for _ in range(rng.randint(8, 20))))
+		parts.append("?s=" + "".join(rng.choice(SHAPES["byte"]) for _ in range(rng.randint(2, 8))))
+	return "".join(parts)
+
+# longest prefix of text that still fits the version, or None if even one
+# character needs a larger version
+def get_payload(text, version, error_level):
+	low, high = 0, len(text)
+	while low < high:
+		mid = (low + high + 1) // 2
+		try:
+			fits = qr.get_version(text[:mid], error_level) <= version
+		except RuntimeError:
+			fits = False
+		if fits:
+			low = mid
+		else:
+			high = mid - 1
+	if low == 0 or qr.get_version(text[:low], error_level) != version:
+		return None
+	return text[:low]
+
+# runs every stage once, returning {stage: nanoseconds}
+def run_stages(msg, error_level):
+	times = {}
+	clock = time.perf_counter_ns
+
+	start = clock()
+	version = qr.get_version(msg, error_level)
+	times["get_version"] = clock() - start
+
+	start = clock()
+	data = qr.get_formatted_data(msg, version=version, error_level=error_level)
+	times["get_formatted_data"] = clock() - start
+
+	start = clock()
+	codewords = qr.error_correction(data, error_level=error_level, version=version)
+	times["error_correction"] = clock() - start
+
+	start = clock()
+	matrix = draw.base(version)
+	times["base"] = clock() - start
+
+	start = clock()
+	draw.insert_data(matrix, codewords)
+	times["insert_data"] = clock() - start
+
+	start = clock()
+	candidates = [draw.apply_mask(matrix, mask) for mask in draw.MASKS]
+	times["apply_mask"] = clock() - start
+
+	start = clock()
+	scores = [draw.get_penalty_score(candidate) for candidate in candidates]
+	times["get_penalty_score"] = clock() - start
+
+	best = candidates[scores.index(min(scores))]
+	start = clock()
+	raster.write_png(best, io.BytesIO())
+	times["render"] = clock() - start
+	return times
+
+def percentile(values, fraction):
+	values = sorted(values)
+	return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def bench_case(msg, error_level, repeat):
+	samples = {stage: [] for stage in STAGES}
+	totals = []
+	run_stages(msg, error_level) # warm the template and generator caches
+	for _ in range(repeat):
+		times = run_stages(msg, error_level)
+		for stage in STAGES:
+			samples[stage].append(times[stage])
+		totals.append(sum(times.values()))
+
+	tracemalloc.start()
+	run_stages(msg, error_level)
+	(_, peak) = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	return {
+		"symbols_per_sec": len(totals) / (sum(totals) / 1e9),
+		"peak_memory_bytes": peak,
+		"stages": {
+			stage: {
+				"p50_us": percentile(values, 0.5) / 1000,
+				"p90_us": percentile(values, 0.9) / 1000,
+				"p99_us": percentile(values, 0.99) / 1000,
+			}
+			for (stage, values) in samples.items()
+		},
+	}
+
+def run(versions, levels, shapes, repeat):
+	results = []
+	for shape in shapes:
+		text = get_source_text(shape)
+		for version in versions:
+			for level in levels:
+				msg = get_payload(text, version, level)
+				if msg is None:
+					continue
+				result = {"version": version, "level": level, "shape": shape, "length": len(msg)}
+				result.update(bench_case(msg, level, repeat))
+				results.append(result)
+				print("v%d %s %-12s %8.1f symbols/s" % (version, level, shape, result["symbols_per_sec"]), file=sys.stderr)
+	return {"python": sys.version.split()[0], "repeat": repeat, "results": results}
+
+# lists every stage whose median got slower than the baseline by more than threshold
+def compare(baseline, current, threshold=0.1):
+	old_results = {(r["version"], r["level"], r["shape"]): r for r in baseline["results"]}
+	regressions = []
+	for result in current["results"]:
+		old = old_results.get((result["version"], result["level"], result["shape"]))
+		if old is None:
+			continue
+		for (stage, timing) in result["stages"].items():
+			if stage not in old["stages"]:
+				continue
+			before = old["stages"][stage]["p50_us"]
+			after = timing["p50_us"]
+			if before > 0 and after > before * (1 + threshold):
+				regressions.append({
+					"version": result["version"], "level": result["level"], "shape": result["shape"],
+					"stage": stage, "baseline_us": before, "current_us": after, "ratio": after / before,
+				})
+	return regressions
+
+# parses "1-10,20,40" into [1, ..., 10, 20, 40]
+def parse_versions(text):
+	versions = []
+	for part in text.split(","):
+		if "-" in part:
+			(first, last) = part.split("-")
+			versions.extend(range(int(first), int(last) + 1))
+		else:
+			versions.append(int(part))
+	return versions
+
+def main():
+	parser = argparse.ArgumentParser(description="time each stage of qr code generation")
+	parser.add_argument("--versions", default="1-%d" % qr.MAX_VERSION, help="e.g. 1-10,20,40")
+	parser.add_argument("--levels", default="LMQH")
+	parser.add_argument("--shapes", default="byte,mixed", help="any of " + ",".join(SHAPES))
+	parser.add_argument("--repeat", type=int, default=5)
+	parser.add_argument("--output", help="write the json report here instead of stdout")
+	parser.add_argument("--compare", metavar="BASELINE", help="flag regressions against a saved report")
+	parser.add_argument("--threshold", type=float, default=0.1, help="allowed slowdown before flagging, as a fraction")
+	args = parser.parse_args()
+
+	report = run(parse_versions(args.versions), list(args.levels), args.shapes.split(","), args.repeat)
+	if args.compare:
+		with open(args.compare) as f:
+			report["regressions"] = compare(json.load(f), report, args.threshold)
+
+	if args.output:
+		with open(args.output, "w") as f:
+			json.dump(report, f, indent=2)
+	else:
+		json.dump(report, sys.stdout, indent=2)
+		print()
+
+	if report.get("regressions"):
+		for r in report["regressions"]:
+			print("REGRESSION v%(version)d %(level)s %(shape)s %(stage)s: %(baseline_us).1fus -> %(current_us).1fus" % r, file=sys.stderr)
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,110 @@
+import hashlib
+import mmap
+import os
+import struct
+from collections import OrderedDict
+import draw
+import files
+import qr
+
+# rough per-entry cost of the key, QRMatrix object and dict slot, on top of its arrays
+ENTRY_OVERHEAD = 256
+
+# disk entries are a 2 byte big-endian symbol size followed by the packed modules
+DISK_HEADER = struct.Struct(">H")
+
+class SymbolCache:
+	"""Two-level cache of finished symbols.
+
+	The first level is an in-memory LRU holding at most `max_bytes` worth of
+	symbols. If `directory` is given, symbols are also written there as packed
+	bitmaps, named by a hash of their key, and read back with mmap, so they
+	survive restarts and can be shared between processes. Counts of hits, misses,
+	evictions and disk traffic are kept in `stats`.
+	"""
+	def __init__(self, max_bytes=64 << 20, directory=None):
+		self.max_bytes = max_bytes
+		self.directory = directory
+		self.entries = OrderedDict()
+		self.current_bytes = 0
+		self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "disk_writes": 0}
+		if directory is not None:
+			os.makedirs(directory, exist_ok=True)
+
+	def __len__(self):
+		return len(self.entries)
+
+	def get_path(self, key):
+		digest = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+		return os.path.join(self.directory, digest + ".qrm")
+
+	# returns a copy of the cached symbol, or None if it is in neither level
+	def get(self, key):
+		symbol = self.entries.get(key)
+		if symbol is not None:
+			self.entries.move_to_end(key)
+			self.stats["hits"] += 1
+			return symbol.copy()
+
+		if self.directory is not None:
+			symbol = self.read_disk(key)
+			if symbol is not None:
+				self.stats["disk_hits"] += 1
+				self.put_memory(key, symbol)
+				return symbol.copy()
+
+		self.stats["misses"] += 1
+		return None
+
+	def put(self, key, symbol):
+		symbol = symbol.copy()
+		self.put_memory(key, symbol)
+		if self.directory is not None:
+			self.write_disk(key, symbol)
+
+	def put_memory(self, key, symbol):
+		if key in self.entries:
+			self.current_bytes -= self.get_entry_bytes(self.entries.pop(key))
+		self.entries[key] = symbol
+		self.current_bytes += self.get_entry_bytes(symbol)
+		while self.current_bytes > self.max_bytes and len(self.entries) > 1:
+			(_, evicted) = self.entries.popitem(last=False)
+			self.current_bytes -= self.get_entry_bytes(evicted)
+			self.stats["evictions"] += 1
+
+	def get_entry_bytes(self, symbol):
+		return len(symbol.modules) + len(symbol.reserved) + ENTRY_OVERHEAD
+
+	# the symbol stored for key, or None if there is none or it can't be read back
+	# whole, so that a damaged entry is only a miss
+	def read_disk(self, key):
+		try:
+			with open(self.get_path(key), "rb") as f:
+				with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+					(size,) = DISK_HEADER.unpack_from(data)
+					if not 21 <= size <= 17 + 4*qr.MAX_VERSION or (size - 17) % 4 != 0:
+						return None
+					if len(data) != DISK_HEADER.size + (size*size + 7) // 8:
+						return None
+					return draw.QRMatrix.unpack(size, data[DISK_HEADER.size:])
+		except (OSError, ValueError, struct.error):
+			return None
+
+	# written to a temporary file first, so readers never see a partial entry
+	def write_disk(self, key, symbol):
+		files.replace_file(self.get_path(key), DISK_HEADER.pack(symbol.size) + symbol.pack())
+		self.stats["disk_writes"] += 1
+
+	def clear(self):
+		self.entries.clear()
+		self.current_bytes = 0
+
+	# same as qr.make_qr, but only encodes symbols that aren't already cached. every
+	# strategy that searches for the best mask gives the same symbol, so they share a key
+	def make_qr(self, msg, error_level='M', mode=None, version=None, mask_strategy="exhaustive"):
+		key = (msg, error_level, mode, version, draw.get_fixed_mask(mask_strategy))
+		symbol = self.get(key)
+		if symbol is None:
+			symbol = qr.make_qr(msg, error_level=error_level, mode=mode, version=version, mask_strategy=mask_strategy)
+			self.put(key, symbol)
+		return symbol
@@ -0,0 +1,263 @@
+from operator import itemgetter
+import draw
+import qr
+
+# every valid 15 bit format string, as an int, mapped to its (error_level, mask)
+FORMAT_INFO = {
+	int("".join("1" if bit else "0" for bit in draw.get_format_string(level, mask)), 2): (level, mask)
+	for level in "LMQH" for mask in range(len(draw.MASKS))
+}
+
+# (x, y) of each format bit, least significant first, for both copies. this is
+# the inverse of draw.insert_format_string
+def get_format_positions(size):
+	first = []
+	second = []
+	for i in range(15):
+		if i <= 7:
+			first.append((size-i-1, 8))
+			second.append((8, i+1) if i >= 6 else (8, i))
+		else:
+			first.append((8, i+size-15))
+			second.append((7, 8) if i == 8 else (14-i, 8))
+	return (first, second)
+
+MODES = {indicator: mode for (mode, indicator) in qr.MODE_INDICATORS.items()}
+STRUCTURED_APPEND = 0b0011
+ALPHANUMERIC_CHARS = "".join(sorted(qr.ALPHANUMERIC_VALUES, key=qr.ALPHANUMERIC_VALUES.get))
+BIT_DIGITS = bytes([ord("1") if i else ord("0") for i in range(256)])
+
+class DecodeError(ValueError):
+	"""Raised when a symbol can't be read back, or has more errors than its
+	error correction codewords can repair."""
+
+class BitReader:
+	"""Reads a big-endian bit stream, the inverse of qr.BitWriter."""
+	def __init__(self, data):
+		self.value = int.from_bytes(data, "big")
+		self.remaining = len(data)*8
+
+	def __len__(self):
+		return self.remaining
+
+	def read(self, count):
+		if count > self.remaining:
+			raise DecodeError("data ended in the middle of a segment")
+		self.remaining -= count
+		return (self.value >> self.remaining) & ((1 << count) - 1)
+
+# returns (error_level, mask), taking whichever copy of the format string is
+# closest to a valid one. up to three flipped bits are tolerated
+def read_format(matrix):
+	best = None
+	for positions in get_format_positions(matrix.size):
+		bits = 0
+		for (x, y) in reversed(positions):
+			bits = (bits << 1) | (matrix.get(x, y) == draw.Color.black)
+		for (candidate, info) in FORMAT_INFO.items():
+			distance = bin(bits ^ candidate).count("1")
+			if best is None or distance < best[0]:
+				best = (distance, info)
+	if best[0] > 3:
+		raise DecodeError("format information is unreadable")
+	return best[1]
+
+_readers = {}
+
+# a callable picking out the data modules of a version in placement order
+def get_data_reader(version):
+	if version not in _readers:
+		_readers[version] = itemgetter(*draw.get_template(version)[1])
+	return _readers[version]
+
+# returns (version, error_level, mask, codewords) with the codewords still interleaved
+def read_codewords(matrix):
+	size = matrix.size
+	version = (size - 17) // 4
+	if size < 21 or (size - 17) % 4 != 0 or version > qr.MAX_VERSION:
+		raise DecodeError("%d is not a valid symbol size" % size)
+	(error_level, mask) = read_format(matrix)
+
+	# unmask the whole symbol at once, the same way draw.apply_mask masks it
+	length = size * size
+	dark = int.from_bytes(matrix.dark(), "big") ^ draw.get_mask_plane(size, draw.MASKS[mask])
+	bits = bytes(get_data_reader(version)(dark.to_bytes(length, "big")))
+	num_codewords = qr.get_raw_data_modules(version) // 8
+	bits = bits[:num_codewords*8].translate(BIT_DIGITS)
+	return (version, error_level, mask, int(bits, 2).to_bytes(num_codewords, "big"))
+
+# the inverse of the interleaving in qr.error_correction. returns a list of
+# blocks, each its data codewords followed by its error correction codewords
+def split_blocks(codewords, error_level, version):
+	(g1, g2) = qr.BLOCKING_DICT[error_level][version]
+	sizes = g1 + (g2 or [])
+	num_ec = qr.EC_TABLE[error_level][version]
+	blocks = [bytearray() for _ in sizes]
+	offset = 0
+	for j in range(max(sizes)):
+		for (block, block_size) in zip(blocks, sizes):
+			if j < block_size:
+				block.append(codewords[offset])
+				offset += 1
+	for j in range(num_ec):
+		for block in blocks:
+			block.append(codewords[offset])
+			offset += 1
+	return (sizes, blocks)
+
+# the block evaluated as a polynomial at each root of the generator polynomial,
+# alpha**0 to alpha**(num_ec-1). all of them are zero for an undamaged block
+def get_syndromes(block, num_ec):
+	syndromes = []
+	for i in range(num_ec):
+		s = 0
+		for codeword in block:
+			if s:
+				s = qr.AI_EXT[qr.IA[s] + i] ^ codeword
+			else:
+				s = codeword
+		syndromes.append(s)
+	return syndromes
+
+def field_div(a, b):
+	if a == 0:
+		return 0
+	return qr.AI_EXT[qr.IA[a] + 255 - qr.IA[b]]
+
+# evaluates a polynomial given lowest order coefficient first
+def poly_eval(poly, x):
+	result = 0
+	for coefficient in reversed(poly):
+		result = qr.field_mult(result, x) ^ coefficient
+	return result
+
+# finds the error locator polynomial (lowest order first) with Berlekamp-Massey
+def find_error_locator(syndromes):
+	locator = [1]
+	previous = [1]
+	num_errors = 0
+	shift = 1
+	last_discrepancy = 1
+	for n in range(len(syndromes)):
+		discrepancy = syndromes[n]
+		for i in range(1, num_errors + 1):
+			discrepancy ^= qr.field_mult(locator[i], syndromes[n-i])
+		if discrepancy == 0:
+			shift += 1
+			continue
+		factor = field_div(discrepancy, last_discrepancy)
+		updated = locator + [0] * max(0, len(previous) + shift - len(locator))
+		for (i, coefficient) in enumerate(previous):
+			updated[i+shift] ^= qr.field_mult(factor, coefficient)
+		if 2*num_errors <= n:
+			previous = locator
+			num_errors = n + 1 - num_errors
+			last_discrepancy = discrepancy
+			shift = 1
+		else:
+			shift += 1
+		locator = updated
+	return locator[:num_errors+1]
+
+# corrects the block in place with Berlekamp-Massey and Forney's algorithm,
+# returning the number of codewords fixed
+def correct_block(block, num_ec):
+	syndromes = get_syndromes(block, num_ec)
+	if not any(syndromes):
+		return 0
+	locator = find_error_locator(syndromes)
+	num_errors = len(locator) - 1
+	if 2*num_errors > num_ec:
+		raise DecodeError("too many errors to correct")
+
+	# an error at codeword j is at power p = n-1-j, and is a root of the locator at alpha**-p
+	n = len(block)
+	powers = [p for p in range(n) if poly_eval(locator, qr.AI[-p % 255]) == 0]
+	if len(powers) != num_errors:
+		raise DecodeError("too many errors to correct")
+
+	# error evaluator, syndromes times locator mod x**num_ec
+	evaluator = [0] * num_ec
+	for (i, s) in enumerate(syndromes):
+		for (j, l) in enumerate(locator[:num_ec-i]):
+			evaluator[i+j] ^= qr.field_mult(s, l)
+	derivative = [locator[i] if i % 2 else 0 for i in range(1, len(locator))]
+
+	for p in powers:
+		x_inverse = qr.AI[-p % 255]
+		magnitude = field_div(qr.field_mult(qr.AI[p], poly_eval(evaluator, x_inverse)), poly_eval(derivative, x_inverse))
+		block[n-1-p] ^= magnitude
+	if any(get_syndromes(block, num_ec)):
+		raise DecodeError("too many errors to correct")
+	return num_errors
+
+# true if every block of the symbol has zero syndromes. this is as cheap as
+# generating the error correction codewords, so every symbol can be checked
+def verify(matrix):
+	try:
+		(version, error_level, _, codewords) = read_codewords(matrix)
+	except DecodeError:
+		return False
+	num_ec = qr.EC_TABLE[error_level][version]
+	(_, blocks) = split_blocks(codewords, error_level, version)
+	for block in blocks:
+		if any(get_syndromes(block, num_ec)):
+			return False
+	return True
+
+# returns the data codewords of the symbol, repairing damaged blocks if correct is
+# set, along with the number of codewords repaired
+def get_data(matrix, correct=True):
+	(version, error_level, _, codewords) = read_codewords(matrix)
+	num_ec = qr.EC_TABLE[error_level][version]
+	(sizes, blocks) = split_blocks(codewords, error_level, version)
+	data = bytearray()
+	fixed = 0
+	for (block, block_size) in zip(blocks, sizes):
+		if correct:
+			fixed += correct_block(block, num_ec)
+		elif any(get_syndromes(block, num_ec)):
+			raise DecodeError("symbol has errors")
+		data += block[:block_size]
+	return (version, bytes(data), fixed)
+
+# splits the data codewords back into [(mode, text)] segments. a structured
+# append header, if there is one, is returned as (index, total, parity)
+def parse_segments(data, version):
+	reader = BitReader(data)
+	segments = []
+	header = None
+	while len(reader) >= 4:
+		indicator = reader.read(4)
+		if indicator == 0:
+			break
+		if indicator == STRUCTURED_APPEND:
+			header = (reader.read(4), reader.read(4) + 1, reader.read(8))
+			continue
+		if indicator not in MODES:
+			raise DecodeError("unsupported mode indicator %d" % indicator)
+		mode = MODES[indicator]
+		count = reader.read(qr.char_count_bits(version, mode))
+		if mode == qr.NUMERIC:
+			digits = []
+			for i in range(0, count, 3):
+				width = min(3, count - i)
+				digits.append("%0*d" % (width, reader.read((1, 4, 7, 10)[width])))
+			text = "".join(digits)
+		elif mode == qr.ALPHANUMERIC:
+			chars = []
+			for _ in range(count // 2):
+				value = reader.read(11)
+				chars.append(ALPHANUMERIC_CHARS[value // 45] + ALPHANUMERIC_CHARS[value % 45])
+			if count % 2:
+				chars.append(ALPHANUMERIC_CHARS[reader.read(6)])
+			text = "".join(chars)
+		else:
+			text = bytes(reader.read(8) for _ in range(count)).decode("utf-8", errors="replace")
+		segments.append((mode, text))
+	return (segments, header)
+
+def decode(matrix, correct=True):
+	(version, data, _) = get_data(matrix, correct)
+	(segments, _) = parse_segments(data, version)
+	return "".join(text for (_, text) in segments)
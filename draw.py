@@ -1,19 +1,21 @@
-from enum import Enum
+from enum import IntEnum
 import math
-from copy import deepcopy
-
-ALIGNMENT_TABLE = {
-  1: [],
-  2: [6, 18],
-  3: [6, 22],
-  4: [6, 26],
-  5: [6, 30],
-  6: [6, 34],
-  7: [6, 22, 38],
-  8: [6, 24, 42],
-  9: [6, 26, 46],
-  10: [6, 28, 50]
-}
+import re
+import sys
+import metrics
+
+# centre coordinates of the alignment patterns, used for both rows and columns. the
+# first is always 6 and the rest are evenly spaced back from the far edge, with the
+# spacing rounded up to an even number of modules
+def get_alignment_positions(version):
+  if version == 1:
+    return []
+  size = (version-1)*4+21
+  num_align = version//7 + 2
+  step = (version*8 + num_align*3 + 5) // (num_align*4 - 4) * 2
+  return [6] + [size-7 - i*step for i in reversed(range(num_align-1))]
+
+ALIGNMENT_TABLE = {version: get_alignment_positions(version) for version in range(1, 41)}
 
 MASKS = [
   lambda col, row: (row + col) % 2 == 0,
@@ -33,78 +35,212 @@ CORRECTION_INT_TABLE = {
   "H": 0b10
 }
 
-CONDITION_3_PATTERN = [False, False, False, False, True, False, True, True, True, False, True]
-
-class Color(Enum):
-  white = 1
-  black = 2
-  unset = 3
-
-class Module:
-  def __init__(self):
-    self.color = Color.unset
-    self.reserved = False
-    self.mark = False # mark for debugging purposes
-
-def display_qr(qr):
-  for row in qr:
-    for cell in row:
-      msg = "  "
-      if cell.mark:
-        msg = " "
-        print(cell.mark, end="")
-      if cell.color == Color.black:
-        print("\033[40m" + msg + "\033[0m", end="")
-      elif cell.color == Color.white:
-        print("\033[47m" + msg + "\033[0m", end="")
-      elif cell.reserved == True:
-        print("\033[42m" + msg + "\033[0m", end="") # unset but reserved space
-      else:
-        print("\033[41m" + msg + "\033[0m", end="") # completely unset space
-    print()
+CONDITION_3_PATTERN = bytes([0, 0, 0, 0, 1, 0, 1, 1, 1, 0, 1])
+CONDITION_3_PATTERN_REVERSED = CONDITION_3_PATTERN[::-1]
+
+# module colors, stored one byte per module so a row can be read as a 0/1 bitmap
+class Color(IntEnum):
+  white = 0
+  black = 1
+  unset = 2
+
+# maps every stored color to 1 if black and 0 otherwise (unset counts as white)
+DARK_TABLE = bytes([1 if i == Color.black else 0 for i in range(256)])
+
+# maps every stored color to an ascii "1" if black and "0" otherwise, for int(..., 2)
+DARK_DIGITS = bytes([ord("1") if i == Color.black else ord("0") for i in range(256)])
+
+# the eight bits of every byte value, most significant first, as Color values
+BYTE_BITS = [bytes((value >> (7-i)) & 1 for i in range(8)) for value in range(256)]
+
+class QRMatrix:
+  """A square grid of modules, stored row by row in flat bytearrays.
+
+  `modules` holds one Color value per module and `reserved` holds 1 for every
+  module that belongs to a function pattern and must not receive data or masking.
+  """
+  __slots__ = ("size", "modules", "reserved")
+
+  def __init__(self, size, modules=None, reserved=None):
+    self.size = size
+    self.modules = bytearray([Color.unset]) * (size * size) if modules is None else modules
+    self.reserved = bytearray(size * size) if reserved is None else reserved
+
+  def __len__(self):
+    return self.size
+
+  # the modules without copying them, row by row. memoryview(matrix) gives the
+  # same, but only from python 3.12
+  def view(self):
+    return memoryview(self.modules)
+
+  def __buffer__(self, flags):
+    return self.view()
+
+  def get(self, x, y):
+    return self.modules[y*self.size + x]
+
+  def set(self, x, y, color):
+    self.modules[y*self.size + x] = color
+
+  def is_reserved(self, x, y):
+    return self.reserved[y*self.size + x] == 1
+
+  def reserve(self, x, y, color=None):
+    self.reserved[y*self.size + x] = 1
+    if color is not None:
+      self.modules[y*self.size + x] = color
+
+  def row(self, y):
+    return self.view()[y*self.size:(y+1)*self.size]
+
+  def dark(self):
+    return self.modules.translate(DARK_TABLE)
+
+  # copies are always writable, even of a frozen matrix
+  def copy(self):
+    return QRMatrix(self.size, bytearray(self.modules), bytearray(self.reserved))
+
+  # a read-only copy, backed by bytes, that can be shared and cached safely
+  def freeze(self):
+    return QRMatrix(self.size, bytes(self.modules), bytes(self.reserved))
+
+  # the dark modules as a bitmap, one bit per module row by row, most significant first
+  def pack(self):
+    bits = self.modules.translate(DARK_DIGITS)
+    bits += b"0" * (-len(bits) % 8)
+    return int(bits, 2).to_bytes(len(bits) // 8, "big")
+
+  # inverse of pack for a finished symbol, with the reserved modules of its version
+  @staticmethod
+  def unpack(size, data):
+    modules = bytearray(b"".join([BYTE_BITS[byte] for byte in data])[:size*size])
+    template = get_template((size - 17) // 4)[0]
+    return QRMatrix(size, modules, template.reserved[:])
+
+# ansi color numbers the terminal renderer draws modules in. unset modules only
+# show up while debugging, green if reserved and red if not
+TERMINAL_COLORS = bytes([7 if i == Color.white else 0 if i == Color.black else 1 for i in range(256)])
+TERMINAL_LIGHT = 7
+TERMINAL_DARK = 0
+TERMINAL_RESERVED = 2
+TERMINAL_STYLES = ("color", "unicode", "ascii")
+
+# half blocks for (top dark, bottom dark), used when there is no color
+UNICODE_BLOCKS = {(False, False): " ", (True, False): "\u2580", (False, True): "\u2584", (True, True): "\u2588"}
+
+# the module rows of qr as lists of ansi color numbers, with a border of light
+# modules added around them on the fly
+def get_terminal_rows(qr, border):
+  quiet = [TERMINAL_LIGHT] * border
+  quiet_row = [TERMINAL_LIGHT] * (qr.size + 2*border)
+  rows = [quiet_row] * border
+  for y in range(qr.size):
+    row = list(qr.row(y).tobytes().translate(TERMINAL_COLORS))
+    if Color.unset in qr.row(y):
+      for x in range(qr.size):
+        if qr.get(x, y) == Color.unset and qr.is_reserved(x, y):
+          row[x] = TERMINAL_RESERVED
+    rows.append(quiet + row + quiet)
+  rows.extend([quiet_row] * border)
+  return rows
+
+# draws two module rows per line of text with the upper half block, its foreground
+# the top module and its background the bottom one. escape codes are only written
+# when a color actually changes, and cells whose halves match are just a space
+def get_color_text(rows):
+  lines = []
+  for i in range(0, len(rows), 2):
+    top = rows[i]
+    bottom = rows[i+1] if i+1 < len(rows) else [TERMINAL_LIGHT] * len(top)
+    line = []
+    fg = bg = None
+    for (t, b) in zip(top, bottom):
+      codes = []
+      if t != b and t != fg:
+        codes.append("3%d" % t)
+        fg = t
+      if b != bg:
+        codes.append("4%d" % b)
+        bg = b
+      if codes:
+        line.append("\033[%sm" % ";".join(codes))
+      line.append(" " if t == b else "\u2580")
+    line.append("\033[0m\n")
+    lines.append("".join(line))
+  return "".join(lines)
+
+# the same layout in plain half blocks, dark modules drawn filled
+def get_unicode_text(rows):
+  lines = []
+  for i in range(0, len(rows), 2):
+    top = rows[i]
+    bottom = rows[i+1] if i+1 < len(rows) else [TERMINAL_LIGHT] * len(top)
+    lines.append("".join(UNICODE_BLOCKS[(t == TERMINAL_DARK, b == TERMINAL_DARK)] for (t, b) in zip(top, bottom)))
+  return "\n".join(lines) + "\n"
+
+# one line per module row, two characters per module so they come out square
+def get_ascii_text(rows):
+  return "".join("".join("##" if c == TERMINAL_DARK else "  " for c in row) + "\n" for row in rows)
+
+# renders qr with a border of light modules as text, in one of TERMINAL_STYLES
+def get_terminal_text(qr, border=2, style="color"):
+  rows = get_terminal_rows(qr, border)
+  if style == "color":
+    return get_color_text(rows)
+  elif style == "unicode":
+    return get_unicode_text(rows)
+  elif style == "ascii":
+    return get_ascii_text(rows)
+  raise ValueError("unknown terminal style %r" % style)
+
+# prints the whole symbol with a single write
+def display_qr(qr, border=2, style="color"):
+  sys.stdout.write(get_terminal_text(qr, border, style))
+  sys.stdout.flush()
 
 def finder_pattern(qr, xstart, ystart):
   for x in range(xstart, xstart+9):
     for y in range(ystart, ystart+9):
-      if x >= 0 and y >= 0 and x < len(qr) and y < len(qr[0]): # don't draw if off side of code
+      if x >= 0 and y >= 0 and x < qr.size and y < qr.size: # don't draw if off side of code
         from_center = max(abs(x-xstart-4), abs(y-ystart-4))
-        qr[y][x].reserved = True
         if from_center == 2 or from_center == 4:
-          qr[y][x].color = Color.white
+          qr.reserve(x, y, Color.white)
         else:
-          qr[y][x].color = Color.black
+          qr.reserve(x, y, Color.black)
 
 def alignment_pattern(qr, xstart, ystart):
   # check to make sure the space isn't occupied by something already
   for x in range(xstart, xstart+5):
     for y in range(ystart, ystart+5):
-      if qr[y][x].reserved == True:
+      if qr.is_reserved(x, y):
         return
 
   for x in range(xstart, xstart+5):
     for y in range(ystart, ystart+5):
-      qr[y][x].reserved = True
       if max(abs(x-xstart-2), abs(y-ystart-2)) == 1:
-        qr[y][x].color = Color.white
+        qr.reserve(x, y, Color.white)
       else:
-        qr[y][x].color = Color.black
-
-def wrap_with_border(qr):
-  mod = Module()
-  mod.color = Color.white
-  mod.reserved = True
-  for row in qr:
-    row.insert(0, mod)
-    row.append(mod)
-  qr.insert(0, [mod] * len(qr[0]))
-  qr.append([mod] * len(qr[0]))
-
-# 0 = unclaimed free space
-# 1 = black
-# -1 = white
+        qr.reserve(x, y, Color.black)
+
+# function patterns and data positions don't depend on the message, so they are
+# built once per version and every symbol starts from a copy of the template
+_templates = {}
+
+# returns (template, data_positions) for a version, where data_positions holds the
+# flat index of every data module in the order insert_data fills them
+def get_template(version):
+  if version not in _templates:
+    template = draw_function_patterns(version)
+    _templates[version] = (template, get_data_positions(template))
+  return _templates[version]
+
 def base(version):
+  return get_template(version)[0].copy()
+
+def draw_function_patterns(version):
   size = (version-1)*4+21
-  qr = [[Module() for i in range(size)] for j in range(size)]
+  qr = QRMatrix(size)
 
   # add finder patterns
   finder_pattern(qr, -1, -1) # starts at negative 1, since separator is off side of code
@@ -119,121 +255,198 @@ def base(version):
 
   # add timing patterns
   for i in range(size):
-    if qr[i][6].reserved == False:
-      qr[i][6].reserved = True
-      qr[i][6].color = Color.black if i % 2 == 0 else Color.white
-    if qr[6][i].reserved == False:
-      qr[6][i].reserved = True
-      qr[6][i].color = Color.black if i % 2 == 0 else Color.white
+    if not qr.is_reserved(6, i):
+      qr.reserve(6, i, Color.black if i % 2 == 0 else Color.white)
+    if not qr.is_reserved(i, 6):
+      qr.reserve(i, 6, Color.black if i % 2 == 0 else Color.white)
 
   # add dark module
-  qr[size-8][8].color = Color.black
-  qr[size-8][8].reserved = True
+  qr.reserve(8, size-8, Color.black)
 
   # add reserved areas
-  qr[8][8].reserved = True
+  qr.reserve(8, 8)
   for i in range(0, 8):
-    qr[i][8].reserved = True
-    qr[8][i].reserved = True
-    qr[8][size-i-1].reserved = True
-    qr[size-i-1][8].reserved = True
+    qr.reserve(8, i)
+    qr.reserve(i, 8)
+    qr.reserve(size-i-1, 8)
+    qr.reserve(8, size-i-1)
   if version >= 7:
     for i in range(0, 3):
       for j in range(0, 6):
-        qr[size-9-i][j].reserved = True
-        qr[j][size-9-i].reserved = True
+        qr.reserve(j, size-9-i)
+        qr.reserve(size-9-i, j)
 
   return qr
 
+# masks as big integers with one byte per module, 1 wherever the mask flips the
+# module, cached by (size, mask)
+_mask_planes = {}
+
+def get_mask_plane(size, mask):
+  if (size, mask) not in _mask_planes:
+    plane = bytes(1 if mask(x, y) else 0 for y in range(size) for x in range(size))
+    _mask_planes[(size, mask)] = int.from_bytes(plane, "big")
+  return _mask_planes[(size, mask)]
+
+# after xoring a mask into the modules an unset module (2) reads 3, which the mask
+# turns black like any other non-black module
+MASK_FIX_TABLE = bytes([Color.black if i == Color.unset ^ 1 else i for i in range(256)])
+
+# flips every unreserved module the mask covers, as one xor over the whole symbol
 def apply_mask(qr, mask):
-  qr = deepcopy(qr)
-  size = len(qr)
-  for x in range(size):
-    for y in range(size):
-      if mask(x, y) and not qr[y][x].reserved:
-        if qr[y][x].color == Color.black:
-          qr[y][x].color = Color.white
-        else:
-          qr[y][x].color = Color.black
-  return qr
+  length = qr.size * qr.size
+  flips = get_mask_plane(qr.size, mask) & ~int.from_bytes(qr.reserved, "big")
+  modules = (int.from_bytes(qr.modules, "big") ^ flips).to_bytes(length, "big")
+  return QRMatrix(qr.size, bytearray(modules.translate(MASK_FIX_TABLE)), bytearray(qr.reserved))
+
+# the penalty rules below each take the dark bitmap of the symbol as rows and columns
+# of 0/1 bytes. the slower ones stop early, returning a partial score, once the
+# score reaches limit
+
+# runs of five or more same-colored modules in a line score 3, plus 1 for every
+# module past the fifth
+RUN_PATTERN = re.compile(b"\x00{5,}|\x01{5,}")
 
-def get_penalty_score(qr):
+def get_run_penalty(rows, columns, limit=None):
   penalty = 0
-  size = len(qr)
-
-  # eval condition 1
-  for flipped in [False, True]:
-    for i in range(size):
-      white = 0
-      black = 0
-      for j in range(size):
-        cell = qr[i][j] if flipped else qr[j][i]
-        if cell.color == Color.black: # count unset squares as white
-          white = 0
-          black += 1
-        else:
-          black = 0
-          white += 1
-
-        if white == 5 or black == 5:
-          penalty += 3
-        elif white > 5 or black > 5:
-          penalty += 1
-
-  # eval condition 2
-  for x in range(size-1):
-    for y in range(size-1):
-      first = qr[y][x].color == Color.black
-      all_same = True
-      for i in range(2):
-        for j in range(2):
-          if first != (qr[y+i][x+j].color == Color.black):
-            all_same = False
-      if all_same:
-        penalty += 3
-
-  # eval condition 3
-  for flip_axis in [False, True]:
-    for x in range(size-10 if flip_axis else size):
-      for y in range(size if flip_axis else size-10):
-        matched_forward = True
-        matched_backward = True
-        for i in range(11):
-          mod = qr[y][x+i] if flip_axis else qr[y+i][x]
-          if (mod.color == Color.black) != CONDITION_3_PATTERN[i]:
-            matched_forward = False
-          if (mod.color == Color.black) != CONDITION_3_PATTERN[-i-1]:
-            matched_backward = False
-
-        if matched_forward or matched_backward:
-          penalty += 40
-          mod = qr[y][x+1] if flip_axis else qr[y+1][x]
-
-  # eval condition 4
-  total_count = size ** 2
-  dark_count = 0
-  for row in qr:
-    for item in row:
-      if item.color == Color.black:
-        dark_count += 1
+  for line in rows + columns:
+    for run in RUN_PATTERN.finditer(line):
+      penalty += run.end() - run.start() - 2
+    if limit is not None and penalty >= limit:
+      break
+  return penalty
+
+# 2x2 blocks of one color. each row is read as a big integer with one module per
+# byte, so comparing neighbours is a shift and an xor over the whole row, and the
+# low bit of each byte says whether that pair of modules matched
+def get_block_penalty(rows, columns, limit=None):
+  size = len(rows)
+  ones = int.from_bytes(b"\x01" * size, "big")
+  values = [int.from_bytes(row, "big") for row in rows]
+  penalty = 0
+  for y in range(size-1):
+    top = values[y]
+    same_below = top ^ values[y+1] ^ ones # module matches the one below it
+    same_right = top ^ (top >> 8) ^ ones # module matches the one to its left
+    # drop the first byte, which has no module to its left
+    blocks = same_below & (same_below >> 8) & same_right & (ones >> 8)
+    penalty += 3 * bin(blocks).count("1")
+    if limit is not None and penalty >= limit:
+      break
+  return penalty
+
+# finder-like patterns, found with bytes.find. a window can match at most one of
+# the two patterns, so counting them separately gives the same total
+def get_finder_penalty(rows, columns, limit=None):
+  penalty = 0
+  for line in rows + columns:
+    for pattern in (CONDITION_3_PATTERN, CONDITION_3_PATTERN_REVERSED):
+      i = line.find(pattern)
+      while i != -1:
+        penalty += 40
+        i = line.find(pattern, i+1)
+  return penalty
+
+# distance of the proportion of dark modules from half
+def get_balance_penalty(rows, columns, limit=None):
+  total_count = len(rows) ** 2
+  dark_count = sum(row.count(1) for row in rows)
   per_20 = (dark_count / total_count) * 20
   low = abs(math.floor(per_20)*5 - 50) // 5 # next down multiple of 5 of the percent dark
   high = abs(math.ceil(per_20)*5 - 50) // 5 # next up multiple of 5 of the percent dark
-  penalty += min(low, high) * 10
+  return min(low, high) * 10
 
+# cheapest rules first, so a score that is already too high is found out early
+PENALTY_RULES = [get_balance_penalty, get_finder_penalty, get_run_penalty, get_block_penalty]
+
+# total penalty score of qr. if limit is given, stops and returns None as soon as
+# the score reaches it
+def get_penalty_score(qr, limit=None):
+  size = qr.size
+  dark = qr.dark()
+  rows = [dark[i*size:(i+1)*size] for i in range(size)]
+  columns = [dark[i::size] for i in range(size)]
+
+  penalty = 0
+  for rule in PENALTY_RULES:
+    penalty += rule(rows, columns, None if limit is None else limit - penalty)
+    if limit is not None and penalty >= limit:
+      return None
   return penalty
 
+MASK_STRATEGIES = ("exhaustive", "pruned")
+
+# mask index asked for by a "fixed=N" strategy (or a plain int), None for the others
+def get_fixed_mask(mask_strategy):
+  if isinstance(mask_strategy, str) and mask_strategy.startswith("fixed="):
+    mask_strategy = int(mask_strategy[len("fixed="):])
+  if isinstance(mask_strategy, int):
+    if not 0 <= mask_strategy < len(MASKS):
+      raise ValueError("mask must be between 0 and %d" % (len(MASKS)-1))
+    return mask_strategy
+  if mask_strategy not in MASK_STRATEGIES:
+    raise ValueError("unknown mask strategy %r" % (mask_strategy,))
+  return None
+
+# returns (mask index, penalty score) using one of the mask strategies:
+#   exhaustive - scores every mask in full and picks the lowest
+#   pruned     - same result, but drops a mask as soon as its partial score
+#                reaches the best so far. always uses the pure python scorer
+#   fixed=N    - uses mask N without scoring anything (the score is None)
+def choose_mask(qr, mask_strategy="exhaustive", mask_scores=None):
+  fixed = get_fixed_mask(mask_strategy)
+  if fixed is not None:
+    return (fixed, None)
+  if mask_strategy == "pruned":
+    return select_mask_pruned(qr)
+  if mask_scores is None:
+    mask_scores = get_mask_scores
+  scores = mask_scores(qr)
+  best_mask = scores.index(min(scores))
+  return (best_mask, scores[best_mask])
+
+# penalty score of qr under every mask in MASKS
+def get_mask_scores(qr):
+  return [get_penalty_score(apply_mask(qr, mask)) for mask in MASKS]
+
+# the lowest scoring mask like the exhaustive search, but abandons each mask once it
+# can no longer win. a mask only wins with a strictly lower score, so ties go to
+# the lower index as before
+def select_mask_pruned(qr):
+  best_mask = 0
+  best_score = None
+  for i in range(len(MASKS)):
+    score = get_penalty_score(apply_mask(qr, MASKS[i]), limit=best_score)
+    if score is not None:
+      best_mask = i
+      best_score = score
+  return (best_mask, best_score)
+
+# places the codewords in data (bytes) along the data path, filling any modules
+# left over after the last codeword with white remainder bits
 def insert_data(qr, data):
-  size = len(qr)
+  positions = get_template((qr.size - 17) // 4)[1]
+  if len(data)*8 > len(positions):
+    print("WARNING: Ran out of space when trying to stuff data into qr code")
+  bits = b"".join([BYTE_BITS[codeword] for codeword in data])
+  bits += bytes(max(0, len(positions) - len(bits)))
+  modules = qr.modules
+  for i, bit in zip(positions, bits):
+    modules[i] = bit
+
+# walks the zigzag data path over the whole symbol, returning the flat index of
+# every unreserved module in placement order
+def get_data_positions(qr):
+  size = qr.size
+  positions = []
   x = size - 1
   y = size - 1
   upward = True
   first = True # True if first in pair, false if second
-  data = list(reversed(data))
-  while len(data) > 0:
-    # skip inserting this data if module is already reserved
-    if not qr[y][x].reserved:
-      qr[y][x].color = Color.black if data.pop() else Color.white
+  while True:
+    # skip this module if it is already reserved
+    if not qr.is_reserved(x, y):
+      positions.append(y*size + x)
 
     # move to next module
     if first:
@@ -255,8 +468,7 @@ def insert_data(qr, data):
       y = size-1
 
     if x < 0:
-      print("WARNING: Ran out of space when trying to stuff data into qr code")
-      return
+      return tuple(positions)
 
     # skip reserved timing column
     if x == 6:
@@ -278,67 +490,77 @@ def get_format_string(correction_level, mask_pattern):
   return final_list
 
 def insert_format_string(qr, format_str):
-  size = len(qr)
+  size = qr.size
   format_str = list(reversed(format_str))
   for i in range(15):
     color = Color.black if format_str[i] else Color.white
     if i <= 7:
-      qr[8][size-i-1].color = color
+      qr.set(size-i-1, 8, color)
       if i >= 6: # skip over timing pattern
-        qr[i+1][8].color = color
+        qr.set(8, i+1, color)
       else:
-        qr[i][8].color = color
+        qr.set(8, i, color)
     else:
-      qr[i+size-7-8][8].color = color
+      qr.set(8, i+size-7-8, color)
       if i == 8:
-        qr[8][7].color = color
+        qr.set(7, 8, color)
       else:
-        qr[8][5+9-i].color = color
+        qr.set(5+9-i, 8, color)
 
+# 6 bit version number followed by its 12 bit BCH error correction code
 def get_version_string(version):
-  res = {
-    7:  "000111110010010100",
-    8:  "001000010110111100",
-    9:  "001001101010011001",
-    10: "001010010011010011"
-  }[version]
-  return list(map(bool, map(int, res)))
+  gen_poly = 0b1111100100101
+  error_bits = version << 12
+  for shift in reversed(range(6)):
+    if error_bits & (1 << (shift + 12)):
+      error_bits ^= gen_poly << shift
+  res = (version << 12) | error_bits
+  return [bool((res >> i) & 1) for i in reversed(range(18))]
 
 def insert_version_string(qr, version_str):
-  size = len(qr)
+  size = qr.size
   for i in range(18):
     color = Color.black if version_str[i] else Color.white
     j = i % 3
     k = i // 3
-    qr[5-k][size-9-j].color = color
-    qr[size-9-j][5-k].color = color
-    qr[size-9-j][5-k].mark = str(i % 10)
+    qr.set(size-9-j, 5-k, color)
+    qr.set(5-k, size-9-j, color)
 
-def generate_qr(version, input_data_str):
-  # put in data
-  input_data = list(map(bool, map(int, input_data_str)))
-  qr = base(version)
-  insert_data(qr, input_data)
-
-  # select best mask
-  best_score = -1
-  best_mask = 0
-  for i in range(len(MASKS)):
-    score = get_penalty_score(apply_mask(qr, MASKS[i]))
-    if best_score == -1 or score < best_score:
-      best_score = score
-      best_mask = i
-  qr = apply_mask(qr, MASKS[best_mask])
+# returns a masked copy of qr with its format and version information filled in
+def finish_symbol(qr, version, error_level, mask):
+  qr = apply_mask(qr, MASKS[mask])
 
   # calculate and add format string
-  format_str = get_format_string("Q", best_mask) # TODO set correct correction level
+  format_str = get_format_string(error_level, mask)
   insert_format_string(qr, format_str)
 
   if version >= 7:
     version_str = get_version_string(version)
     insert_version_string(qr, version_str)
+  return qr
+
+# builds the finished symbol from the final codewords, picking the mask as described
+# by mask_strategy (see choose_mask)
+# mask_scores, if given, replaces get_mask_scores for the exhaustive mask search
+def generate_qr(version, data, error_level="Q", mask_strategy="exhaustive", mask_scores=None):
+  rec = metrics.recorder
+  stopwatch = rec.stopwatch() if rec is not None else None
 
-  # wrap with border and display
-  wrap_with_border(qr)
-  wrap_with_border(qr)
-  display_qr(qr)
+  # put in data
+  qr = base(version)
+  insert_data(qr, data)
+  if stopwatch is not None:
+    stopwatch.split("insert_data")
+
+  # select best mask
+  (best_mask, score) = choose_mask(qr, mask_strategy, mask_scores)
+  if rec is not None and score is not None:
+    rec.observe_penalty(score)
+  if stopwatch is not None:
+    stopwatch.split("select_mask")
+  qr = finish_symbol(qr, version, error_level, best_mask)
+
+  if stopwatch is not None:
+    stopwatch.split("finish_symbol")
+    rec.symbol_done(version, error_level, best_mask)
+  return qr
@@ -0,0 +1,9 @@
+import os
+
+# writes data, bytes or str, to a temporary file next to path and then moves it
+# into place, so readers see either the old contents or the new, never a partial file
+def replace_file(path, data):
+	temp_path = "%s.%d.tmp" % (path, os.getpid())
+	with open(temp_path, "wb" if isinstance(data, bytes) else "w") as f:
+		f.write(data)
+	os.replace(temp_path, path)
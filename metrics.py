@@ -0,0 +1,119 @@
+import threading
+import time
+import files
+
+# the active Recorder, or None while instrumentation is off. instrumented code
+# checks this before doing anything else, so when disabled the only cost is a
+# global lookup and a comparison
+recorder = None
+
+# upper bounds of the penalty score histogram buckets
+PENALTY_BUCKETS = [100, 200, 300, 400, 500, 750, 1000, 1500, 2000, 3000, 5000, 10000, 20000, 50000]
+
+class Stopwatch:
+	"""Records the time since the previous split (or creation) under a stage name."""
+	def __init__(self, recorder):
+		self.recorder = recorder
+		self.last = time.perf_counter_ns()
+
+	def split(self, stage):
+		now = time.perf_counter_ns()
+		self.recorder.observe(stage, now - self.last)
+		self.last = now
+
+class Recorder:
+	"""Collects stage timings, counters and the penalty score histogram.
+
+	Every `flush_every` symbols (if set), and on flush(), the recorder is handed
+	to `sink`, which is any callable taking the recorder. Each process keeps its
+	own recorder, so workers in a pool need to enable instrumentation themselves.
+	"""
+	def __init__(self, sink=None, flush_every=None):
+		self.sink = sink
+		self.flush_every = flush_every
+		self.lock = threading.Lock()
+		self.timings = {} # stage -> [count, total nanoseconds]
+		self.counters = {} # (name, sorted label items) -> value
+		self.penalty_counts = [0] * (len(PENALTY_BUCKETS) + 1)
+		self.penalty_sum = 0
+		self.symbols = 0
+
+	def stopwatch(self):
+		return Stopwatch(self)
+
+	def observe(self, stage, nanoseconds):
+		with self.lock:
+			timing = self.timings.setdefault(stage, [0, 0])
+			timing[0] += 1
+			timing[1] += nanoseconds
+
+	def increment(self, name, amount=1, **labels):
+		key = (name, tuple(sorted(labels.items())))
+		with self.lock:
+			self.counters[key] = self.counters.get(key, 0) + amount
+
+	def observe_penalty(self, score):
+		with self.lock:
+			i = 0
+			while i < len(PENALTY_BUCKETS) and score > PENALTY_BUCKETS[i]:
+				i += 1
+			self.penalty_counts[i] += 1
+			self.penalty_sum += score
+
+	# counts a finished symbol, flushing to the sink every flush_every of them
+	def symbol_done(self, version, error_level, mask):
+		self.increment("symbols", version=version, level=error_level)
+		self.increment("mask_chosen", mask=mask)
+		self.symbols += 1
+		if self.flush_every and self.symbols % self.flush_every == 0:
+			self.flush()
+
+	def flush(self):
+		if self.sink is not None:
+			self.sink(self)
+
+	def to_prometheus(self):
+		with self.lock:
+			lines = ["# TYPE qr_stage_seconds summary"]
+			for (stage, (count, total)) in sorted(self.timings.items()):
+				lines.append('qr_stage_seconds_sum{stage="%s"} %.9f' % (stage, total / 1e9))
+				lines.append('qr_stage_seconds_count{stage="%s"} %d' % (stage, count))
+
+			names = sorted(set(name for (name, _) in self.counters))
+			for name in names:
+				lines.append("# TYPE qr_%s_total counter" % name)
+				for ((counter_name, labels), value) in sorted(self.counters.items()):
+					if counter_name == name:
+						label_text = ",".join('%s="%s"' % (k, v) for (k, v) in labels)
+						lines.append("qr_%s_total{%s} %d" % (name, label_text, value))
+
+			lines.append("# TYPE qr_penalty_score histogram")
+			cumulative = 0
+			for (bound, count) in zip(PENALTY_BUCKETS + ["+Inf"], self.penalty_counts):
+				cumulative += count
+				lines.append('qr_penalty_score_bucket{le="%s"} %d' % (bound, cumulative))
+			lines.append("qr_penalty_score_sum %d" % self.penalty_sum)
+			lines.append("qr_penalty_score_count %d" % cumulative)
+		return "\n".join(lines) + "\n"
+
+# returns a sink that rewrites a prometheus text format file, for node_exporter's
+# textfile collector or similar. the file is replaced atomically on every flush
+def prometheus_file_sink(path):
+	def sink(recorder):
+		files.replace_file(path, recorder.to_prometheus())
+	return sink
+
+def enable(sink=None, flush_every=None):
+	global recorder
+	recorder = Recorder(sink=sink, flush_every=flush_every)
+	return recorder
+
+def disable():
+	global recorder
+	if recorder is not None:
+		recorder.flush()
+	recorder = None
+
+def flush():
+	if recorder is not None:
+		recorder.flush()
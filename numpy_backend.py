@@ -0,0 +1,155 @@
+# vectorized implementations of the hot loops in draw.py and qr.py, behind
+# backends.NumpyBackend. every function here must give exactly the same
+# results as its pure python counterpart
+import math
+import numpy as np
+import draw
+import metrics
+from qr import AI_EXT, BLOCKING_DICT, EC_TABLE, IA, find_generator_log_poly
+
+_mask_grids = {}
+
+# boolean array of shape (len(MASKS), size, size), true wherever a mask flips the module
+def get_mask_grids(size):
+  if size not in _mask_grids:
+    rows, cols = np.indices((size, size))
+    _mask_grids[size] = np.stack([np.asarray(mask(cols, rows), dtype=bool) for mask in draw.MASKS])
+  return _mask_grids[size]
+
+def to_array(data, size):
+  return np.frombuffer(bytes(data), dtype=np.uint8).reshape(size, size).astype(bool)
+
+# stacks every masked version of qr into one (len(MASKS), size, size) dark/light array
+def masked_candidates(qr):
+  size = qr.size
+  dark = to_array(qr.dark(), size)
+  reserved = to_array(qr.reserved, size)
+  return dark ^ (get_mask_grids(size) & ~reserved)
+
+# condition 1 penalty of every candidate, for runs along the last axis
+def _run_penalties(candidates):
+  count, height, width = candidates.shape
+  flat = candidates.reshape(-1)
+  starts = np.empty(flat.shape, dtype=bool)
+  starts[0] = True
+  np.not_equal(flat[1:], flat[:-1], out=starts[1:])
+  starts[::width] = True # a run never continues onto the next line
+  indices = np.flatnonzero(starts)
+  lengths = np.diff(np.append(indices, flat.size))
+  penalties = np.where(lengths >= 5, lengths - 2, 0)
+  return np.bincount(indices // (height * width), weights=penalties, minlength=count).astype(np.int64)
+
+# condition 3 matches of every candidate, for windows along the last axis
+def _finder_like_counts(candidates):
+  width = candidates.shape[-1] - 10
+  if width <= 0:
+    return np.zeros(candidates.shape[0], dtype=np.int64)
+  forward = np.ones(candidates.shape[:-1] + (width,), dtype=bool)
+  backward = forward.copy()
+  for i in range(11):
+    window = candidates[..., i:i+width]
+    forward &= window == bool(draw.CONDITION_3_PATTERN[i])
+    backward &= window == bool(draw.CONDITION_3_PATTERN_REVERSED[i])
+  return (forward | backward).sum(axis=(1, 2))
+
+# same scores as draw.get_penalty_score, for every candidate at once
+def penalty_scores(candidates):
+  columns = np.ascontiguousarray(candidates.transpose(0, 2, 1))
+
+  penalties = _run_penalties(candidates) + _run_penalties(columns)
+
+  top_left = candidates[:, :-1, :-1]
+  blocks = (top_left == candidates[:, 1:, :-1]) & (top_left == candidates[:, :-1, 1:]) & (top_left == candidates[:, 1:, 1:])
+  penalties += blocks.sum(axis=(1, 2)) * 3
+
+  penalties += (_finder_like_counts(candidates) + _finder_like_counts(columns)) * 40
+
+  scores = []
+  total_count = candidates.shape[1] * candidates.shape[2]
+  for penalty, dark_count in zip(penalties.tolist(), candidates.sum(axis=(1, 2)).tolist()):
+    per_20 = (dark_count / total_count) * 20
+    low = abs(math.floor(per_20)*5 - 50) // 5
+    high = abs(math.ceil(per_20)*5 - 50) // 5
+    scores.append(penalty + min(low, high) * 10)
+  return scores
+
+# the symbol with its quiet zone as a (width, width) boolean array of dark
+# modules, with every module scale pixels square
+def get_pixels(qr, scale=1, border=4):
+  dark = np.pad(to_array(qr.dark(), qr.size), border)
+  return dark.repeat(scale, axis=0).repeat(scale, axis=1)
+
+# every pixel row of raster.write_pbm at once, packed most significant bit first
+def get_packed_image(qr, scale=1, border=4):
+  return np.packbits(get_pixels(qr, scale, border), axis=1).tobytes()
+
+# every pixel row of raster.write_pgm at once
+def get_gray_image(qr, scale=1, border=4):
+  return np.where(get_pixels(qr, scale, border), 0, 255).astype(np.uint8).tobytes()
+
+# field tables for whole arrays of codewords. zero's logarithm points past the end
+# of the antilogs into a run of zeros, so products with zero come out zero
+# without any masking
+ZERO_LOG = 512
+FIELD_EXP = np.zeros(ZERO_LOG + 256, dtype=np.uint8)
+FIELD_EXP[:len(AI_EXT)] = AI_EXT
+FIELD_LOG = np.array(IA, dtype=np.intp)
+FIELD_LOG[0] = ZERO_LOG
+
+# error correction codewords of every row of an (n, k) uint8 array of blocks, as
+# an (n, num_ec) array. the same shift register as qr.rs_remainder, run on all the
+# blocks at once: each row is divided in place, and what's left past the data
+# is the remainder
+def rs_remainders(blocks, num_ec):
+  (n, k) = blocks.shape
+  gen_log = np.array(find_generator_log_poly(num_ec), dtype=np.intp)
+  work = np.zeros((n, k + num_ec), dtype=np.uint8)
+  work[:, :k] = blocks
+  for j in range(k):
+    work[:, j+1:j+1+num_ec] ^= FIELD_EXP[FIELD_LOG[work[:, j]][:, None] + gen_log]
+  return work[:, k:]
+
+_interleave_orders = {}
+
+# positions of the data codewords of the (num_blocks, k) array of blocks, right
+# padded, in the order qr.error_correction interleaves them
+def get_interleave_order(error_level, version):
+  if (error_level, version) not in _interleave_orders:
+    (g1, g2) = BLOCKING_DICT[error_level][version]
+    sizes = g1 + (g2 or [])
+    k = max(sizes)
+    order = [b*k + j for j in range(k) for b in range(len(sizes)) if j < sizes[b]]
+    _interleave_orders[(error_level, version)] = np.array(order, dtype=np.intp)
+  return _interleave_orders[(error_level, version)]
+
+# qr.error_correction for many messages of the same version and error level.
+# data is a list of the messages' data codewords, and the result is an array
+# with one row of interleaved codewords per message
+def error_correction_many(data, error_level="L", version=1):
+  (g1, g2) = BLOCKING_DICT[error_level][version]
+  num_ec = EC_TABLE[error_level][version]
+  num_short = len(g1)
+  num_blocks = num_short + len(g2 or [])
+  k = max(g1 + (g2 or []))
+  n = len(data)
+  codewords = np.frombuffer(b"".join(data), dtype=np.uint8).reshape(n, -1)
+
+  # the blocks, both right padded for interleaving and left padded for the
+  # division, where a leading zero doesn't change the remainder
+  right = np.zeros((n, num_blocks, k), dtype=np.uint8)
+  left = np.zeros((n, num_blocks, k), dtype=np.uint8)
+  short_end = num_short * g1[0]
+  short = codewords[:, :short_end].reshape(n, num_short, g1[0])
+  right[:, :num_short, :g1[0]] = short
+  left[:, :num_short, k-g1[0]:] = short
+  if g2 is not None:
+    long = codewords[:, short_end:].reshape(n, num_blocks - num_short, k)
+    right[:, num_short:] = long
+    left[:, num_short:] = long
+
+  ec = rs_remainders(left.reshape(n * num_blocks, k), num_ec).reshape(n, num_blocks, num_ec)
+  if metrics.recorder is not None:
+    metrics.recorder.increment("rs_blocks", n * num_blocks, level=error_level)
+  interleaved_data = right.reshape(n, num_blocks * k)[:, get_interleave_order(error_level, version)]
+  interleaved_ec = ec.transpose(0, 2, 1).reshape(n, num_ec * num_blocks)
+  return np.concatenate([interleaved_data, interleaved_ec], axis=1)
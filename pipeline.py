@@ -0,0 +1,84 @@
+import io
+import draw
+import qr
+import raster
+
+class Pipeline:
+	"""Builds one symbol stage by stage, keeping the result of every stage.
+
+	The stages are get_segments, get_codewords (data codewords), get_interleaved
+	(with error correction added), get_unmasked, get_masked and render. Each one
+	runs the first time it is asked for, running whatever earlier stages it needs
+	that haven't run yet, and afterwards returns the same immutable value: tuples,
+	bytes, or frozen draw.QRMatrix. Renders are kept per format, scale and border,
+	so drawing a finished symbol again at another size only re-runs the render.
+	`backend` is passed to backends.get_backend to pick what runs the stages it covers.
+	"""
+	def __init__(self, msg, error_level="M", mode=None, version=None, mask_strategy="exhaustive", structured_append=None, backend=None):
+		self.msg = msg
+		self.error_level = error_level
+		self.mode = mode
+		self.version = version
+		self.mask_strategy = mask_strategy
+		self.structured_append = structured_append
+		self.backend = backend
+		self.results = {}
+
+	# the result of a stage, computing it only the first time
+	def stage(self, key, compute):
+		if key not in self.results:
+			self.results[key] = compute()
+		return self.results[key]
+
+	def get_version(self):
+		if self.version is None:
+			self.version = qr.get_version(self.msg, error_level=self.error_level, mode=self.mode)
+		return self.version
+
+	def get_segments(self):
+		return self.stage("segments", lambda: tuple(qr.segment_message(self.msg, self.get_version(), mode=self.mode)))
+
+	def get_codewords(self):
+		return self.stage("codewords", lambda: qr.get_segments_data(self.get_segments(), version=self.get_version(),
+			error_level=self.error_level, structured_append=self.structured_append))
+
+	# the backends.Backend running the stages
+	def get_engine(self):
+		import backends
+		return self.stage("engine", lambda: backends.get_backend(self.backend, self.get_version()))
+
+	def get_interleaved(self):
+		def compute():
+			return self.get_engine().error_correction(self.get_codewords(), error_level=self.error_level, version=self.get_version())
+		return self.stage("interleaved", compute)
+
+	def get_unmasked(self):
+		def compute():
+			matrix = draw.base(self.get_version())
+			draw.insert_data(matrix, self.get_interleaved())
+			return matrix.freeze()
+		return self.stage("unmasked", compute)
+
+	# (index into draw.MASKS, penalty score or None if the mask was fixed)
+	def get_mask(self):
+		def compute():
+			return draw.choose_mask(self.get_unmasked(), self.mask_strategy, self.get_engine().mask_scores)
+		return self.stage("mask", compute)
+
+	def get_masked(self):
+		return self.stage("masked", lambda: draw.finish_symbol(self.get_unmasked(), self.get_version(),
+			self.error_level, self.get_mask()[0]).freeze())
+
+	# the symbol as an image in one of raster.WRITERS, as bytes
+	def render(self, format="png", scale=4, border=4):
+		def compute():
+			if format not in raster.WRITERS:
+				raise ValueError("unknown image format %r" % format)
+			f = io.BytesIO()
+			self.get_engine().render(self.get_masked(), f, format, scale=scale, border=border)
+			return f.getvalue()
+		return self.stage(("render", format, scale, border), compute)
+
+	# the symbol as text for a terminal, see draw.get_terminal_text
+	def render_text(self, border=2, style="color"):
+		return self.stage(("render_text", border, style), lambda: draw.get_terminal_text(self.get_masked(), border, style))
@@ -1,117 +1,373 @@
 import draw
-import argparse
-import math
-import copy
+import metrics
+import bisect
+import os
 import sys
 
+MAX_VERSION = 40
+
+# error correcting codewords per block, EC_CODEWORDS_PER_BLOCK[error_level][version-1]
+EC_CODEWORDS_PER_BLOCK = {
+	'L': [7, 10, 15, 20, 26, 18, 20, 24, 30, 18, 20, 24, 26, 30, 22, 24, 28, 30, 28, 28, 28, 28, 30, 30, 26, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30],
+	'M': [10, 16, 26, 18, 24, 16, 18, 22, 22, 26, 30, 22, 22, 24, 24, 28, 28, 26, 26, 26, 26, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28],
+	'Q': [13, 22, 18, 26, 18, 24, 18, 22, 20, 24, 28, 26, 24, 20, 30, 24, 28, 28, 26, 30, 28, 30, 30, 30, 30, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30],
+	'H': [17, 28, 22, 16, 22, 28, 26, 26, 24, 28, 24, 28, 22, 24, 24, 30, 28, 28, 26, 28, 30, 24, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30],
+}
+
+# number of error correction blocks, NUM_EC_BLOCKS[error_level][version-1]
+NUM_EC_BLOCKS = {
+	'L': [1, 1, 1, 1, 1, 2, 2, 2, 2, 4, 4, 4, 4, 4, 6, 6, 6, 6, 7, 8, 8, 9, 9, 10, 12, 12, 12, 13, 14, 15, 16, 17, 18, 19, 19, 20, 21, 22, 24, 25],
+	'M': [1, 1, 1, 2, 2, 4, 4, 4, 5, 5, 5, 8, 9, 9, 10, 10, 11, 13, 14, 16, 17, 17, 18, 20, 21, 23, 25, 26, 28, 29, 31, 33, 35, 37, 38, 40, 43, 45, 47, 49],
+	'Q': [1, 1, 2, 2, 4, 4, 6, 6, 8, 8, 8, 10, 12, 16, 12, 17, 16, 18, 21, 20, 23, 23, 25, 27, 29, 34, 34, 35, 38, 40, 43, 45, 48, 51, 53, 56, 59, 62, 65, 68],
+	'H': [1, 1, 2, 4, 4, 4, 5, 6, 8, 8, 11, 11, 16, 16, 18, 16, 19, 21, 25, 25, 25, 34, 30, 32, 35, 37, 40, 42, 45, 48, 51, 54, 57, 60, 63, 66, 70, 74, 77, 81],
+}
+
+# number of modules left for codewords after the function patterns are drawn,
+# including the few remainder bits some versions have left over
+def get_raw_data_modules(version):
+	size = (version-1)*4+21
+	result = size*size - 3*64 - 2*(size-16) - 31 # finders with separators, timing, format and dark module
+	if version >= 2:
+		num_align = version//7 + 2
+		result -= (num_align*num_align - 3) * 25 # alignment patterns, less the three behind finders
+		result += (num_align - 2) * 2 * 5 # alignment patterns overlapping the timing patterns
+		if version >= 7:
+			result -= 36 # version information
+	return result
+
+NUMERIC = 'numeric'
+ALPHANUMERIC = 'alphanumeric'
+BYTE = 'byte'
+
+MODE_INDICATORS = {NUMERIC: 0b0001, ALPHANUMERIC: 0b0010, BYTE: 0b0100}
+
+# a structured append header is this mode indicator, the symbol's index and the
+# total number of symbols less one (4 bits each), and a parity byte
+STRUCTURED_APPEND_INDICATOR = 0b0011
+STRUCTURED_APPEND_BITS = 20
+MAX_STRUCTURED_APPEND = 16
+
+# the character count indicator grows at versions 10 and 27
+VERSION_RANGES = [(1, 9), (10, 26), (27, MAX_VERSION)]
+
+# character count indicator sizes per mode, one for each of VERSION_RANGES
+CHAR_COUNT_BITS = {NUMERIC: (10, 12, 14), ALPHANUMERIC: (9, 11, 13), BYTE: (8, 16, 16)}
+
+# number of bits used by the character count indicator
+def char_count_bits(version=1, mode=ALPHANUMERIC):
+	if version < 10:
+		return CHAR_COUNT_BITS[mode][0]
+	elif version < 27:
+		return CHAR_COUNT_BITS[mode][1]
+	else:
+		return CHAR_COUNT_BITS[mode][2]
+
+# table of error correcting codewords per block for various versions and error levels
+EC_TABLE = {
+	level: {version: EC_CODEWORDS_PER_BLOCK[level][version-1] for version in range(1, MAX_VERSION+1)}
+	for level in 'LMQH'
+}
+
 # a dictionary specifying required codeword counts. Ordered by version:correction:codewords
 ERROR_CORRECTION_DICT = {
-	1:{'L':19,'M':16,'Q':13,'H':9},
-	2:{'L':34, 'M':28, 'Q':22, 'H':16},
-	3:{'L':55, 'M':44, 'Q':34, 'H':26},
-	4:{'L':80, 'M':64, 'Q':48, 'H':36},
-	5:{'L':108, 'M':86, 'Q':62, 'H':46},
-	6:{'L':136, 'M':108, 'Q':76, 'H':60},
-	7:{'L':156, 'M':124, 'Q':88, 'H':66},
-	8:{'L':194, 'M':154, 'Q':110, 'H':86},
-	9:{'L':232, 'M':182, 'Q':132, 'H':100},
-	10:{'L':274, 'M':216, 'Q':154, 'H':122}
+	version: {
+		level: get_raw_data_modules(version)//8 - EC_TABLE[level][version]*NUM_EC_BLOCKS[level][version-1]
+		for level in 'LMQH'
+	}
+	for version in range(1, MAX_VERSION+1)
 }
 
+# data codewords per block, as (first group, second group or None). the blocks in
+# the second group hold one more data codeword than those in the first
+def get_block_sizes(error_level, version):
+	num_blocks = NUM_EC_BLOCKS[error_level][version-1]
+	total_codewords = get_raw_data_modules(version)//8
+	num_long = total_codewords % num_blocks
+	short_size = total_codewords//num_blocks - EC_TABLE[error_level][version]
+	g1 = [short_size] * (num_blocks - num_long)
+	g2 = [short_size + 1] * num_long if num_long else None
+	return (g1, g2)
+
+BLOCKING_DICT = {
+	level: {version: get_block_sizes(level, version) for version in range(1, MAX_VERSION+1)}
+	for level in 'LMQH'
+}
+
+# largest number of alphanumeric characters that fit in the data codewords
+def get_alphanumeric_capacity(version, error_level):
+	bits = 8*ERROR_CORRECTION_DICT[version][error_level] - 4 - char_count_bits(version)
+	return bits//11*2 + (1 if bits % 11 >= 6 else 0)
+
 # maximum character counts are stored as a dict
 # MAX_CHAR_COUNTS[error_level][version-1]
 MAX_CHAR_COUNTS = {
-	'L': [25, 47, 77, 114, 154,195, 224, 279, 335, 395],
-	'M': [20, 38, 61, 90, 122, 154, 178, 221, 262, 311],
-	'Q': [16, 29, 47, 67, 87, 108, 125, 157, 189,221],
-	'H': [10, 20, 35, 50, 64, 84, 93, 122, 143, 174]
+	level: [get_alphanumeric_capacity(version, level) for version in range(1, MAX_VERSION+1)]
+	for level in 'LMQH'
 }
 
-MODE_INDICATOR = '0010'
+# number of data bits in each version, DATA_BITS[error_level][version-1]
+DATA_BITS = {
+	level: [8*ERROR_CORRECTION_DICT[version][level] for version in range(1, MAX_VERSION+1)]
+	for level in 'LMQH'
+}
 
-def encode_message(msg):
-	alphanumericValueTable = ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9', 'A', 'B', 'C', 'D',
-		'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S', 'T', 'U',
-		'V', 'W', 'X', 'Y', 'Z', ' ', '$', '%', '*', '+', '-', '.', '/', ':']
-	messageEncoding = ""
+ALPHANUMERIC_VALUES = {char: value for value, char in enumerate("0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:")}
+NUMERIC_CHARS = frozenset("0123456789")
+
+class BitWriter:
+	"""Collects a big-endian bit stream into a bytearray.
+
+	Bits are gathered in a small integer accumulator and flushed a whole byte at
+	a time, so writing n bits takes time linear in n.
+	"""
+	def __init__(self):
+		self.data = bytearray()
+		self.acc = 0
+		self.acc_bits = 0
+
+	def __len__(self):
+		return len(self.data)*8 + self.acc_bits
+
+	# append the low `count` bits of value, most significant first
+	def write(self, value, count):
+		self.acc = (self.acc << count) | value
+		self.acc_bits += count
+		while self.acc_bits >= 8:
+			self.acc_bits -= 8
+			self.data.append((self.acc >> self.acc_bits) & 0xff)
+		self.acc &= (1 << self.acc_bits) - 1
+
+	# zero pad out to the next byte boundary
+	def align(self):
+		if self.acc_bits:
+			self.write(0, 8 - self.acc_bits)
+
+	def to_bytes(self):
+		self.align()
+		return bytes(self.data)
+
+def encode_numeric(msg, writer):
+	# groups of three digits take 10 bits, a trailing group of one or two takes 4 or 7
+	for i in range(0, len(msg), 3):
+		group = msg[i:i+3]
+		writer.write(int(group), [0, 4, 7, 10][len(group)])
+
+def encode_alphanumeric(msg, writer):
 	for i in range(len(msg)//2):
-		firstValue = 45 * alphanumericValueTable.index(msg[2*i])
-		secondValue = alphanumericValueTable.index(msg[2*i+1])
-		value = firstValue+secondValue
-		binaryValue = bin(value)[2:].zfill(8)
-		paddingBits = 11 - len(binaryValue)
-		for bit in range(paddingBits):
-			binaryValue = str(0)+str(binaryValue)
-		messageEncoding = messageEncoding + str(binaryValue)
+		value = 45*ALPHANUMERIC_VALUES[msg[2*i]] + ALPHANUMERIC_VALUES[msg[2*i+1]]
+		writer.write(value, 11)
 	if (len(msg) % 2 != 0):
-		lastValue = alphanumericValueTable.index(msg[-1])
-		binaryValue = bin(lastValue)[2:]
-		paddingBits = 6 - len(binaryValue)
-		for bit in range(paddingBits):
-			binaryValue = str(0)+str(binaryValue)
-		messageEncoding = messageEncoding + str(binaryValue)
-	return messageEncoding
-
-def get_version(msg_len, error_level="L"):
-	version = 1
-	while version <= 6 and MAX_CHAR_COUNTS[error_level][version-1] < msg_len:
-		version += 1
-	if version > 4:
-		raise RuntimeError("message is too long for largest supported version size!")
-	return version
-
-def format_char_count(msg_len, version=1):
-	if version == 10:
-		indicatorSize = 11
-	else:
-		indicatorSize = 9
-	messageLengthBinary = bin(msg_len)[2:].zfill(8)
-	paddingBits = indicatorSize - len(messageLengthBinary)
-	charCountValue=""
-	for bit in range(paddingBits):
-		charCountValue = str(0)+str(charCountValue)
-	charCountValue = charCountValue + messageLengthBinary
-	return charCountValue
-
-def get_formatted_data(msg, version=1, error_level="L"):
-	msg = msg.upper()
-	char_count = format_char_count(len(msg), version=version)
-
-	requiredWords = ERROR_CORRECTION_DICT[version][error_level]
-	requiredBits = 8*requiredWords
-
-	encodedMessage = encode_message(msg)
-	terminalBits = min(4, requiredBits-len(encodedMessage))
-	for bit in range(terminalBits):
-		encodedMessage = str(encodedMessage)+str(0)
-
-	temporaryString = MODE_INDICATOR+str(char_count)+str(encodedMessage)
-	while not (len(temporaryString) % 8 == 0):
-		temporaryString = temporaryString + str(0)
-	if (len(temporaryString) != requiredBits):
-		extraBitsNeeded = requiredBits - len(temporaryString)
-		padBytesNeeded = int(extraBitsNeeded / 8)
-
-		temporaryString
-		for i in range(padBytesNeeded):
-			if (i % 2) == 0:
-				temporaryString = temporaryString + '11101100'
+		writer.write(ALPHANUMERIC_VALUES[msg[-1]], 6)
+
+def encode_byte(msg, writer):
+	for byte in msg.encode("utf-8"):
+		writer.write(byte, 8)
+
+ENCODERS = {NUMERIC: encode_numeric, ALPHANUMERIC: encode_alphanumeric, BYTE: encode_byte}
+
+# number of characters the character count indicator holds for a segment
+def get_char_count(mode, text):
+	if mode == BYTE:
+		return len(text.encode("utf-8"))
+	return len(text)
+
+def can_encode(mode, char):
+	if mode == NUMERIC:
+		return char in NUMERIC_CHARS
+	elif mode == ALPHANUMERIC:
+		return char in ALPHANUMERIC_VALUES
+	return True
+
+# exact length in bits of the encoded segments, or None if a segment has more
+# characters than its character count indicator can hold in this version. with
+# check_counts false, overlong segments are counted as if they fit
+def get_segments_bits(segments, version=1, check_counts=True):
+	bits = 0
+	for (mode, text) in segments:
+		count = get_char_count(mode, text)
+		count_bits = char_count_bits(version, mode)
+		if check_counts and count >= 1 << count_bits:
+			return None
+		if mode == NUMERIC:
+			data_bits = count//3*10 + [0, 4, 7][count % 3]
+		elif mode == ALPHANUMERIC:
+			data_bits = count//2*11 + count%2*6
+		else:
+			data_bits = count*8
+		bits += 4 + count_bits + data_bits
+	return bits
+
+SEGMENT_MODES = (NUMERIC, ALPHANUMERIC, BYTE)
+
+# the steps of segment_message's search, one per character of msg as it is read:
+# (bits, closed mode, started). bits is the length of the cheapest encoding of the
+# characters so far, ignoring character count limits, closed mode the index into
+# SEGMENT_MODES its last segment is in, and started whether a segment in each
+# mode would start at this character. being a generator, it can be stopped as
+# soon as a prefix of msg gets too long
+def get_segment_steps(msg, version=1):
+	header_costs = [(4 + char_count_bits(version, m)) * 6 for m in SEGMENT_MODES]
+	infinity = 1 << 62 # larger than any real cost, and still an int so it rounds cleanly
+	best = [infinity, infinity, infinity]
+	closed_cost = 0 # cheapest encoding so far that ends on a whole bit
+	for char in msg:
+		costs = [20 if char in NUMERIC_CHARS else infinity,
+			33 if char in ALPHANUMERIC_VALUES else infinity,
+			48 * len(char.encode("utf-8"))]
+		new_best = []
+		started = []
+		for m in range(3):
+			start_cost = closed_cost + header_costs[m]
+			if best[m] <= start_cost:
+				new_best.append(best[m] + costs[m])
+				started.append(False)
 			else:
-				temporaryString = temporaryString + '00010001'
-
-	return_string = ""
-	for i in range(len(temporaryString)):
-		if i % 8 == 0:
-			return_string = return_string+" "
-		return_string = return_string+temporaryString[i]
-	return return_string
+				new_best.append(start_cost + costs[m])
+				started.append(True)
+		best = new_best
+
+		closed = [-(-cost // 6) * 6 for cost in best]
+		closed_cost = min(closed)
+		yield (closed_cost // 6, closed.index(closed_cost), started)
+
+# splits msg into a list of (mode, text) segments giving the shortest bit stream.
+# costs are kept in sixths of a bit so numeric (10 bits per 3 characters) and
+# alphanumeric (11 bits per 2) characters both have whole costs. best[mode] is the
+# cheapest encoding of the characters so far whose last segment is in that mode,
+# and a segment can only start after a whole number of bits. if mode is given the
+# whole message is encoded in that one mode instead
+def segment_message(msg, version=1, mode=None):
+	if mode is not None:
+		if not all(can_encode(mode, char) for char in msg):
+			raise ValueError("message can't be encoded in %s mode" % mode)
+		return [(mode, msg)] if msg else []
+	if not msg:
+		return []
+
+	modes = SEGMENT_MODES
+	closed_modes = [] # mode the cheapest whole-bit encoding ended in, per position
+	started = [] # whether the segment at each position starts there, per mode
+	for (_, closed_mode, step_started) in get_segment_steps(msg, version):
+		closed_modes.append(closed_mode)
+		started.append(step_started)
+
+	# walk back through the choices to recover the segments
+	segments = []
+	m = closed_modes[-1]
+	end = len(msg)
+	for i in reversed(range(len(msg))):
+		if started[i][m]:
+			segments.append((modes[m], msg[i:end]))
+			end = i
+			if i > 0:
+				m = closed_modes[i-1]
+	segments.reverse()
+	return segments
+
+# smallest version that fits msg at this error level
+def get_version(msg, error_level="L", mode=None):
+	for (first, last) in VERSION_RANGES:
+		bits = get_segments_bits(segment_message(msg, first, mode=mode), first)
+		if bits is None:
+			continue
+		version = bisect.bisect_left(DATA_BITS[error_level], bits, first-1, last) + 1
+		if version <= last:
+			return version
+	raise RuntimeError("message is too long for largest supported version size!")
+
+# returns the data codewords for msg as bytes, padded out to the capacity of the version.
+# structured_append is an optional (index, total, parity) header to start with
+def get_formatted_data(msg, version=1, error_level="L", mode=None, structured_append=None):
+	segments = segment_message(msg, version, mode=mode)
+	return get_segments_data(segments, version=version, error_level=error_level, structured_append=structured_append)
+
+# the same for a message already split into [(mode, text)] segments
+def get_segments_data(segments, version=1, error_level="L", structured_append=None):
+	requiredBits = DATA_BITS[error_level][version-1]
+
+	writer = BitWriter()
+	if structured_append is not None:
+		(index, total, parity) = structured_append
+		writer.write(STRUCTURED_APPEND_INDICATOR, 4)
+		writer.write(index, 4)
+		writer.write(total - 1, 4)
+		writer.write(parity, 8)
+	for (segment_mode, text) in segments:
+		writer.write(MODE_INDICATORS[segment_mode], 4)
+		writer.write(get_char_count(segment_mode, text), char_count_bits(version, segment_mode))
+		ENCODERS[segment_mode](text, writer)
+	if len(writer) > requiredBits:
+		raise RuntimeError("message is too long for version %d!" % version)
+
+	terminalBits = min(4, requiredBits-len(writer))
+	writer.write(0, terminalBits)
+	writer.align()
+
+	padBytesNeeded = (requiredBits - len(writer)) // 8
+	for i in range(padBytesNeeded):
+		writer.write(0b11101100 if i % 2 == 0 else 0b00010001, 8)
+
+	return writer.to_bytes()
+
+# the parity byte shared by every symbol of a structured append set, all the
+# bytes of the whole message xored together
+def get_structured_append_parity(msg):
+	parity = 0
+	for byte in msg.encode("utf-8"):
+		parity ^= byte
+	return parity
+
+# length of the longest slice of msg starting at start that fits in one symbol of
+# this version along with a structured append header. the cheapest encoding of
+# each longer slice is found from the one before, so the slice is only read once.
+# no symbol holds enough characters for a segment to reach its character count limit
+def get_part_length(msg, start, version, error_level="L", mode=None):
+	capacity = DATA_BITS[error_level][version-1] - STRUCTURED_APPEND_BITS
+	end = min(len(msg), start + capacity*3//10 + 1) # numeric is the densest mode
+	if mode is not None:
+		# a single segment, so each probe only has to count its bits
+		low = 0
+		high = end - start
+		while low < high:
+			mid = (low + high + 1) // 2
+			if get_segments_bits(segment_message(msg[start:start+mid], version, mode=mode), version) <= capacity:
+				low = mid
+			else:
+				high = mid - 1
+		return low
+	length = 0
+	for (bits, _, _) in get_segment_steps(msg[start:end], version):
+		if bits > capacity:
+			break
+		length += 1
+	return length
+
+# splits msg into at most max_parts parts for a structured append set, all on the
+# smallest version that can hold the whole message that way. each part is filled
+# as far as it goes, which for a given version gives the fewest parts. returns
+# (version, parts)
+def split_structured_append(msg, error_level="L", mode=None, max_parts=MAX_STRUCTURED_APPEND):
+	if not 1 <= max_parts <= MAX_STRUCTURED_APPEND:
+		raise ValueError("a structured append set has 1 to %d symbols" % MAX_STRUCTURED_APPEND)
+	for (first, last) in VERSION_RANGES:
+		# splitting never makes the message shorter, so no version with less than
+		# its share of the bits in every part can hold it
+		bits = get_segments_bits(segment_message(msg, first, mode=mode), first, check_counts=False)
+		needed = -(-bits // max_parts) + STRUCTURED_APPEND_BITS
+		lowest = bisect.bisect_left(DATA_BITS[error_level], needed, first-1, last) + 1
+		for version in range(lowest, last+1):
+			parts = []
+			start = 0
+			while start < len(msg) and len(parts) < max_parts:
+				length = get_part_length(msg, start, version, error_level, mode)
+				if length == 0:
+					break
+				parts.append(msg[start:start+length])
+				start += length
+			if start == len(msg):
+				return (version, parts or [""])
+	raise RuntimeError("message is too long for a structured append set!")
 
-BLOCKING_DICT = {
-	'L':{1:([19],None), 2:([34],None), 3:([55],None), 4:([80],None), 5:([108],None), 6:([68, 68],None), 7:([78, 78],None), 8:([97, 97],None), 9:([116, 116],None), 10:([68, 68],[69, 69])},
-	'M':{1:([16],None), 2:([28],None), 3:([44],None), 4:([32, 32],None), 5:([43, 43],None), 6:([27, 27, 27, 27],None), 7:([31, 31, 31, 31],None), 8:([38, 38],[39, 39]), 9:([36, 36, 36],[37, 37]), 10:([43, 43, 43, 43],[44])},
-	'Q':{1:([13],None), 2:([22],None), 3:([17, 17],None), 4:([24, 24],None), 5:([15, 15],[16, 16]), 6:([19, 19, 19, 19],None), 7:([14, 14],[15, 15, 15, 15]), 8:([18, 18, 18, 18],[19, 19]), 9:([16, 16, 16, 16],[17, 17, 17, 17]), 10:([19, 19, 19, 19, 19, 19],[20, 20])},
-	'H':{1:([9],None), 2:([16],None), 3:([13, 13],None), 4:([9, 9, 9, 9],None), 5:([11, 11],[12, 12]), 6:([15, 15, 15, 15],None), 7:([13, 13, 13, 13],[14]), 8:([14, 14, 14, 14],[15, 15]), 9:([12, 12, 12, 12],[13, 13, 13, 13]), 10:([15, 15, 15, 15, 15, 15],[16, 16])}
-}
 # returns list of groups [(num_blocks_in_group, num_codewords_per_block, ec)]
 def get_blocking_counts(error_level="L", version=1):
 	(g1, g2) = BLOCKING_DICT[error_level][version]
@@ -120,98 +376,50 @@ def get_blocking_counts(error_level="L", version=1):
 	else:
 		return [(len(g1), g1[0]), (len(g2), g2[0])]
 
-# table of error correcting codewords per block for various versions and error levels
-EC_TABLE = {
-	'L':{1:7, 2:10, 3:15, 4:20, 5:26, 6:18, 7:20, 8:26, 9:30, 10:18},
-	'M':{1:10, 2:16, 3:26, 4:18, 5:24, 6:16, 7:18, 8:22, 9:22, 10:26},
-	'Q':{1:13, 2:22, 3:18, 4:26, 5:18, 6:24, 7:18, 8:22, 9:20, 10:24},
-	'H':{1:17, 2:28, 3:22, 4:16, 5:22, 6:28, 7:26, 8:26, 9:24, 10:28}
-}
-
-def error_correction(encoded_msg, error_level="L", version=1):
+# splits the data codewords into blocks, computes the error correction codewords for each,
+# and returns the interleaved data and error correction codewords as bytes
+def error_correction(data, error_level="L", version=1):
 	error_cw_per_block = EC_TABLE[error_level][version]
-	gen_poly_template = find_generator_poly(error_cw_per_block)
 	group_blockings = get_blocking_counts(error_level=error_level, version=version)
-	msg_poly = list(filter(len, encoded_msg.split(" "))) # filter out empty strings
 
-	# convert each binary string into a number, which become coefficients of the gen polynomial
-	msg_poly = list(map(lambda i: int(i,2), msg_poly))
-
-	group_data = []
-	group_err = []
+	data_blocks = []
+	offset = 0
 	for (num_blocks, codewords_per_block) in group_blockings:
-		# pull numbers from global message polynomial into groupings
-		blocks = []
 		for block_num in range(num_blocks):
-			block_data = []
-			for codeword_num in range(codewords_per_block):
-				block_data.append(msg_poly[block_num*codewords_per_block + codeword_num])
-			blocks.append(block_data)
-		group_data.append(blocks)
-
-		# multiply gen poly so degree is same as eventual error correction poly
-
-		err_codewords = []
-		for block in blocks:
-			# copy block into result polynomial, multiply by number of error codewords per block so that
-			# the lead term's exponent doesn't run out during divison
-			# this is called the message polynomial too, but it has this nameh to distinguish from the
-			# global msg_poly
-			result_poly = block[:]
-			for _ in range(error_cw_per_block):
-				result_poly.append(0)
-
-			# division loop: number of division steps is equal to number of terms in message polynomial
-			for j in range(codewords_per_block):
-
-				# copy gen poly base, multiply so degree is same as result poly
-				gen_poly = gen_poly_template[:]
-				while len(gen_poly) < len(result_poly):
-					gen_poly.append(0)
-
-				# multiply generator poly by lead term of of msg poly
-				for i in range(len(gen_poly)):
-					gen_poly[i] = field_mult(result_poly[0], gen_poly[i])
-
-				# xor result with msg polynomial
-				for i in range(len(result_poly)):
-					result_poly[i] = gen_poly[i]^result_poly[i]
-
-				# slice away the now-zero leading term
-				result_poly = result_poly[1:]
-
-			err_codewords.append(result_poly)
-		group_err.append(err_codewords)
-
-	for a in [group_data, group_err]:
-		for b in a:
-			for c in b:
-				for i in range(len(c)):
-					c[i] = bin(c[i])[2:].zfill(8)
+			data_blocks.append(data[offset:offset+codewords_per_block])
+			offset += codewords_per_block
+	err_blocks = [rs_remainder(block, error_cw_per_block) for block in data_blocks]
+	if metrics.recorder is not None:
+		metrics.recorder.increment("rs_blocks", len(data_blocks), level=error_level)
 
+	interleaved = bytearray()
 	max_data_cw = max(map(lambda i: i[1], group_blockings))
-	max_group = group_blockings[0][0]
-	interleaved_msg = ""
-	interleaved_err = ""
 	for j in range(max_data_cw):
-		for i in range(max_group):
-			for group in group_data:
-				if i < len(group) and j < len(group[i]):
-					interleaved_msg += str(group[i][j])
-
+		for block in data_blocks:
+			if j < len(block):
+				interleaved.append(block[j])
 	for j in range(error_cw_per_block):
-		for i in range(max_group):
-			for group in group_err:
-				if i < len(group) and j < len(group[i]):
-					interleaved_err += str(group[i][j])
-
-	finalMessage = interleaved_msg+interleaved_err
-	remainderBits = [0, 7, 7, 7, 7, 7, 0, 0, 0, 0]
-	numRemainderBits = remainderBits[version - 1]
-	for bit in range(numRemainderBits):
-		finalMessage = finalMessage + str(0)
-
-	return finalMessage
+		for block in err_blocks:
+			interleaved.append(block[j])
+
+	return bytes(interleaved)
+
+# divides the block (as a polynomial) by the generator polynomial and returns the
+# remainder, which are the error correction codewords. this is the usual shift
+# register formulation: each data codeword is xored into the lead term of the
+# running remainder, which is then shifted and reduced by the generator in place
+def rs_remainder(block, numberECWords):
+	gen_log = find_generator_log_poly(numberECWords)
+	remainder = [0] * numberECWords
+	for codeword in block:
+		factor = codeword ^ remainder[0]
+		del remainder[0]
+		remainder.append(0)
+		if factor != 0:
+			factor_log = IA[factor]
+			for i in range(numberECWords):
+				remainder[i] ^= AI_EXT[factor_log + gen_log[i]]
+	return remainder
 
 # Alpha-to-int
 AI = [
@@ -235,71 +443,165 @@ AI = [
   233, 207, 131, 27, 54, 108, 216, 173, 71, 142
 ]
 
+# Int-to-alpha, the inverse of AI. IA[0] is undefined since zero has no logarithm
+IA = [0] * 256
+for alpha, value in enumerate(AI):
+	IA[value] = alpha
+
+# AI repeated twice, so the sum of two logarithms can index it without a modulo
+AI_EXT = AI + AI
+
 # multiple two numbers in the bitwise field
 def field_mult(a, b):
 	if a == 0 or b == 0:
 		return 0
-	a_alpha = AI.index(a)
-	b_alpha = AI.index(b)
-	res_alpha = (a_alpha + b_alpha) % 255
-	return AI[res_alpha]
+	return AI_EXT[IA[a] + IA[b]]
 
-def find_generator_poly(numberECWords):
-	# if numberECWords == 7:
-	# 	return [2**0, 2**87, 2**229, 2**146, 2**149, 2**238, 2**102, 2**21]
-	# else:
-	# 	previousPoly = self.find_generator_poly(numberECWords - 1)
-	# 	multPoly = [1, 2**(numberECWords-1)]
-	# 	returnPoly = []
-	# 	for term in range(numberECWords):
-	# 		returnPoly.append(0)
-	# 	for i in range(len(previousPoly)):
-	# 		for j in range(2):
-	# 			prevPolyExp = math.log(previousPoly[i], 2)
-	# 			multPolyExp = math.log(multPoly[j], 2)
-	# 			resultExp = ((prevPolyExp+multPolyExp)%256)+math.floor((prevPolyExp+multPolyExp/256))
-	# 			returnPoly[i+j] = returnPoly[i+j]^int((2**resultExp))
-	# 	return returnPoly
-	generatorPolynomials = {
-		7: [AI[0], AI[87], AI[229], AI[147], AI[149], AI[238], AI[102], AI[21]],
-		8: [AI[0], AI[175], AI[238], AI[208], AI[249], AI[215], AI[252], AI[196], AI[28]],
-		9: [AI[0], AI[95], AI[246], AI[137], AI[231], AI[235], AI[149], AI[11], AI[123], AI[36]],
-		10: [AI[0], AI[251], AI[67], AI[46], AI[61], AI[118], AI[70], AI[64], AI[94], AI[32], AI[45]],
-		11: [AI[0], AI[220], AI[192], AI[91], AI[194], AI[172], AI[177], AI[209], AI[116], AI[227], AI[10], AI[55]],
-		12: [AI[0], AI[102], AI[43], AI[98], AI[121], AI[187], AI[113], AI[198], AI[143], AI[131], AI[87], AI[157], AI[66]],
-		13: [AI[0], AI[74], AI[152], AI[176], AI[100], AI[86], AI[100], AI[106], AI[104], AI[130], AI[218], AI[206], AI[140], AI[78]],
-		14: [AI[0], AI[199], AI[249], AI[155], AI[48], AI[190], AI[124], AI[218], AI[137], AI[216], AI[87], AI[207], AI[59], AI[22], AI[91]],
-		15: [AI[0], AI[8], AI[183], AI[61], AI[91], AI[202], AI[37], AI[51], AI[58], AI[58], AI[237], AI[140], AI[124], AI[5], AI[99], AI[105]],
-		16: [AI[0], AI[120], AI[104], AI[107], AI[109], AI[102], AI[161], AI[76], AI[3], AI[191], AI[147], AI[169], AI[182], AI[194], AI[225], AI[120]],
-		17: [AI[0], AI[43], AI[139], AI[206], AI[78], AI[43], AI[239], AI[123], AI[206], AI[214], AI[147], AI[24], AI[99], AI[150], AI[39], AI[243], AI[163], AI[136]],
-		18: [AI[0], AI[215], AI[234], AI[158], AI[94], AI[184], AI[97], AI[118], AI[170], AI[79], AI[187], AI[152], AI[148], AI[252], AI[179], AI[5], AI[98], AI[96], AI[153]],
-		19: [AI[0], AI[57], AI[3], AI[105], AI[153], AI[52], AI[90], AI[83], AI[17], AI[150], AI[159], AI[44], AI[128], AI[153], AI[133], AI[252], AI[222], AI[138], AI[220], AI[171]],
-		20: [AI[0], AI[17], AI[60], AI[79], AI[50], AI[61], AI[163], AI[26], AI[187], AI[202], AI[180], AI[221], AI[225], AI[83], AI[239], AI[156], AI[164], AI[212], AI[212], AI[188], AI[190]],
-		21: [AI[0], AI[240], AI[233], AI[104], AI[247], AI[181], AI[140], AI[67], AI[98], AI[85], AI[200], AI[210], AI[115], AI[148], AI[137], AI[230], AI[36], AI[122], AI[254], AI[148], AI[175], AI[210]],
-		22: [AI[0], AI[210], AI[171], AI[247], AI[242], AI[93], AI[230], AI[14], AI[109], AI[221], AI[53], AI[200], AI[74], AI[8], AI[172], AI[98], AI[80], AI[219], AI[134], AI[160], AI[105], AI[165], AI[231]],
-		23: [AI[0], AI[171], AI[102], AI[146], AI[91], AI[49], AI[103], AI[65], AI[17], AI[193], AI[150], AI[14], AI[25], AI[183], AI[248], AI[94], AI[164], AI[224], AI[192], AI[1], AI[78], AI[56], AI[147], AI[253]],
-		24: [AI[0], AI[229], AI[121], AI[135], AI[48], AI[211], AI[117], AI[251], AI[126], AI[159], AI[180], AI[169], AI[152], AI[192], AI[226], AI[228], AI[218], AI[111], AI[0], AI[117], AI[232], AI[87], AI[96], AI[227], AI[21]],
-		25: [AI[0], AI[231], AI[181], AI[156], AI[39], AI[170], AI[26], AI[12], AI[59], 215, AI[148], AI[201], AI[54], AI[66], AI[237], AI[208], AI[99], AI[167], AI[144], AI[182], AI[95], AI[243], AI[129], AI[178], AI[252], AI[45]],
-		26: [AI[0], AI[173], AI[125], AI[158], AI[2], AI[103], AI[182], AI[118], AI[17], AI[145], AI[201], AI[111], AI[28], AI[165], AI[53], AI[161], AI[21], AI[245], AI[142], AI[13], AI[102], AI[48], AI[227], AI[153], AI[145], AI[218], AI[70]],
-		27: [AI[0], AI[79], AI[228], AI[8], AI[165], AI[227], AI[21], AI[180], AI[29], AI[9], AI[237], AI[70], AI[99], AI[45], AI[58], AI[138], AI[135], AI[73], AI[126], AI[172], AI[94], AI[216], AI[193], AI[157], AI[26], AI[17], AI[149], AI[96]],
-		28: [AI[0], AI[168], AI[223], AI[200], AI[104], AI[224], AI[234], AI[108], AI[180], AI[110], AI[190], AI[195], AI[147], AI[205], AI[27], AI[232], AI[201], AI[21], AI[43], AI[245], AI[87], AI[42], AI[195], AI[212], AI[119], AI[242], AI[37], AI[9], AI[123]]
-	}
+# generator polynomials are cached by degree once computed, stored as the alpha
+# exponents of every coefficient after the leading 1
+_generator_log_polys = {}
+
+def find_generator_log_poly(numberECWords):
+	if numberECWords not in _generator_log_polys:
+		poly = find_generator_poly(numberECWords)
+		_generator_log_polys[numberECWords] = [IA[c] for c in poly[1:]]
+	return _generator_log_polys[numberECWords]
 
-	return generatorPolynomials[numberECWords]
+_generator_polys = {}
 
-def get_qr(msg, error_level='M'):
-	version = get_version(len(msg), error_level=error_level)
-	encoded_msg = get_formatted_data(msg, version=version, error_level=error_level)
-	fullyEncodedMessage = error_correction(encoded_msg, version=version, error_level=error_level)
-	draw.generate_qr(version, fullyEncodedMessage)
+# the generator polynomial is the product (x - a^0)(x - a^1)...(x - a^(n-1)), with
+# coefficients as integers and the highest order term first
+def find_generator_poly(numberECWords):
+	if numberECWords not in _generator_polys:
+		poly = [1]
+		for i in range(numberECWords):
+			# multiply by (x + a^i); subtraction is xor in this field
+			next_poly = poly + [0]
+			for j in range(len(poly)):
+				next_poly[j+1] ^= field_mult(poly[j], AI[i])
+			poly = next_poly
+		_generator_polys[numberECWords] = poly
+	return _generator_polys[numberECWords][:]
+
+# encodes msg and returns the finished symbol as a draw.QRMatrix, without a quiet zone.
+# the version is picked automatically unless given, and the mask as set by
+# mask_strategy: "exhaustive", "pruned" or "fixed=N" (see draw.choose_mask)
+# backend is the name of one of backends.BACKENDS, "auto" for the fastest one at
+# this version, or None for the default (see backends.get_default_name)
+def make_qr(msg, error_level='M', mode=None, version=None, mask_strategy="exhaustive", structured_append=None, backend=None):
+	rec = metrics.recorder
+	stopwatch = rec.stopwatch() if rec is not None else None
+
+	if version is None:
+		version = get_version(msg, error_level=error_level, mode=mode)
+	if stopwatch is not None:
+		stopwatch.split("get_version")
+	encoded_msg = get_formatted_data(msg, version=version, error_level=error_level, mode=mode, structured_append=structured_append)
+	if stopwatch is not None:
+		stopwatch.split("get_formatted_data")
+	import backends
+	engine = backends.get_backend(backend, version)
+	fullyEncodedMessage = engine.error_correction(encoded_msg, error_level=error_level, version=version)
+	if stopwatch is not None:
+		stopwatch.split("error_correction")
+	return draw.generate_qr(version, fullyEncodedMessage, error_level=error_level, mask_strategy=mask_strategy, mask_scores=engine.mask_scores)
+
+def get_qr(msg, error_level='M', style="color", backend=None):
+	qr = make_qr(msg, error_level=error_level, backend=backend)
+	rec = metrics.recorder
+	stopwatch = rec.stopwatch() if rec is not None else None
+	draw.display_qr(qr, border=2, style=style)
+	if stopwatch is not None:
+		stopwatch.split("display")
+	return qr
+
+# encodes one request per line of lines, writing the symbols as images to output
+# one after another, or to files in output_dir. a line is either the message
+# itself or a json object like {"msg": "...", "level": "M", "format": "png",
+# "name": "label-1"}, where only msg is required. returns the number of lines
+# that failed, after reporting each to stderr
+def stream(lines, output, error_level="Q", format="pbm", output_dir=None, scale=1, border=4, backend=None):
+	import json
+	import backends
+	import raster
+
+	backends.get_numpy_backend() # worth importing for a whole stream, if it is installed
+	failures = 0
+	for (line_num, line) in enumerate(lines, 1):
+		line = line.rstrip("\r\n")
+		if not line:
+			continue
+		try:
+			if line.startswith("{"):
+				request = json.loads(line)
+			else:
+				request = {"msg": line}
+			if not isinstance(request, dict):
+				raise ValueError("request must be a json object")
+			for field in ("msg", "level", "format", "name"):
+				if field in request and not isinstance(request[field], str):
+					raise ValueError("%s must be a string" % field)
+			symbol_level = request.get("level", error_level)
+			if symbol_level not in EC_TABLE:
+				raise ValueError("unknown error level %r" % symbol_level)
+			symbol_format = request.get("format", format)
+			if symbol_format not in raster.WRITERS:
+				raise ValueError("unknown image format %r" % symbol_format)
+			symbol = make_qr(request["msg"], error_level=symbol_level, backend=backend)
+			renderer = backends.get_backend(backend, (symbol.size - 17) // 4)
+		except (ValueError, KeyError, RuntimeError) as e:
+			print("line %d: %s" % (line_num, e), file=sys.stderr)
+			failures += 1
+			continue
+
+		if output_dir is None:
+			renderer.render(symbol, output, symbol_format, scale=scale, border=border)
+		else:
+			name = os.path.basename(request.get("name", str(line_num)))
+			with open(os.path.join(output_dir, "%s.%s" % (name, symbol_format)), "wb") as f:
+				renderer.render(symbol, f, symbol_format, scale=scale, border=border)
+	return failures
 
 def main():
-	if len(sys.argv) == 1:
-		print("Usage: qr.py <msg> <opt error level>")
-	elif len(sys.argv) == 2:
-		get_qr(sys.argv[1], error_level="Q")
+	import argparse
+	parser = argparse.ArgumentParser(description="print a qr code, or encode a stream of them")
+	parser.add_argument("msg", nargs="?")
+	parser.add_argument("error_level", nargs="?", choices=list("LMQH"))
+	parser.add_argument("--level", choices=list("LMQH"), help="error correction level, Q by default. the only way to set it for --stream")
+	parser.add_argument("--style", default="color", choices=draw.TERMINAL_STYLES, help="how to print a single code: ansi colors, plain unicode blocks or ascii")
+	parser.add_argument("--backend", help="reference, numpy, or auto for the fastest one here")
+	parser.add_argument("--stream", action="store_true", help="encode one message or json request per line of stdin")
+	parser.add_argument("--format", default="pbm", help="image format for --stream: pbm, pgm, png or svg")
+	parser.add_argument("--output-dir", help="write --stream images here, one file each, instead of to stdout")
+	parser.add_argument("--scale", type=int, default=1)
+	parser.add_argument("--border", type=int, default=4)
+	args = parser.parse_args()
+	if args.level is not None and args.error_level not in (None, args.level):
+		parser.error("two different error levels given")
+	error_level = args.level or args.error_level or "Q"
+	if args.scale < 1 or args.border < 0:
+		parser.error("scale must be at least 1 and border at least 0")
+	if args.stream and args.msg is not None:
+		parser.error("--stream reads its messages from stdin, use --level to set their error level")
+	if args.backend not in (None, "auto"):
+		import backends
+		try:
+			backends.get_backend(args.backend)
+		except ValueError as e:
+			parser.error(str(e))
+
+	if args.stream:
+		if args.output_dir is not None:
+			os.makedirs(args.output_dir, exist_ok=True)
+		# images go out in large writes rather than a few bytes at a time
+		with open(sys.stdout.fileno(), "wb", buffering=1 << 20, closefd=False) as output:
+			failures = stream(sys.stdin, output, error_level=error_level, format=args.format,
+				output_dir=args.output_dir, scale=args.scale, border=args.border, backend=args.backend)
+		sys.exit(1 if failures else 0)
+	elif args.msg is None:
+		parser.print_usage()
 	else:
-		get_qr(sys.argv[1], error_level=sys.argv[2])
+		get_qr(args.msg, error_level=error_level, style=args.style, backend=args.backend)
 
 if __name__ == "__main__":
 	main()
\ No newline at end of file
@@ -0,0 +1,101 @@
+import struct
+import zlib
+import draw
+import svg
+
+# stored module colors to ascii digits for int(..., 2), with 1 meaning light. the
+# dark equivalent is draw.DARK_DIGITS
+LIGHT_DIGITS = bytes([ord("0") if i == draw.Color.black else ord("1") for i in range(256)])
+
+# stored module colors to 8 bit gray levels
+GRAY_LEVELS = bytes([0 if i == draw.Color.black else 255 for i in range(256)])
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+def get_image_size(qr, scale=1, border=4):
+  return (qr.size + 2*border) * scale
+
+# yields one bit-packed pixel row (most significant bit first, padded to a whole
+# byte) per module row of the symbol, including the quiet zone. each row is to be
+# repeated scale times. set bits are dark modules, or light ones if invert is set
+def get_packed_rows(qr, scale=1, border=4, invert=False):
+  digits = LIGHT_DIGITS if invert else draw.DARK_DIGITS
+  light = digits[draw.Color.white:draw.Color.white+1]
+  quiet = light * (border*scale)
+  width = get_image_size(qr, scale, border)
+  padding = b"0" * (-width % 8)
+  num_bytes = (width + 7) // 8
+
+  quiet_row = int(light*width + padding, 2).to_bytes(num_bytes, "big")
+  for _ in range(border):
+    yield quiet_row
+  for y in range(qr.size):
+    text = qr.row(y).tobytes().translate(digits)
+    if scale > 1:
+      text = text.replace(b"0", b"0"*scale).replace(b"1", b"1"*scale)
+    yield int(quiet + text + quiet + padding, 2).to_bytes(num_bytes, "big")
+  for _ in range(border):
+    yield quiet_row
+
+# yields one row of 8 bit gray pixels per module row, to be repeated scale times
+def get_gray_rows(qr, scale=1, border=4):
+  light = GRAY_LEVELS[draw.Color.white:draw.Color.white+1]
+  quiet = light * (border*scale)
+  quiet_row = light * get_image_size(qr, scale, border)
+  for _ in range(border):
+    yield quiet_row
+  for y in range(qr.size):
+    row = qr.row(y).tobytes().translate(GRAY_LEVELS)
+    if scale > 1:
+      row = row.replace(b"\x00", b"\x00"*scale).replace(b"\xff", b"\xff"*scale)
+    yield quiet + row + quiet
+  for _ in range(border):
+    yield quiet_row
+
+def write_pbm(qr, f, scale=1, border=4):
+  width = get_image_size(qr, scale, border)
+  f.write(b"P4\n%d %d\n" % (width, width))
+  for row in get_packed_rows(qr, scale, border):
+    f.write(row * scale)
+
+def write_pgm(qr, f, scale=1, border=4):
+  width = get_image_size(qr, scale, border)
+  f.write(b"P5\n%d %d\n255\n" % (width, width))
+  for row in get_gray_rows(qr, scale, border):
+    f.write(row * scale)
+
+def write_png_chunk(f, chunk_type, data):
+  f.write(struct.pack(">I", len(data)))
+  f.write(chunk_type)
+  f.write(data)
+  f.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(chunk_type))))
+
+# writes a 1 bit grayscale png. compressed data is written out as IDAT chunks
+# whenever zlib hands some back, so only a few rows are ever held in memory
+def write_png(qr, f, scale=4, border=4, compression=6):
+  width = get_image_size(qr, scale, border)
+  f.write(PNG_SIGNATURE)
+  write_png_chunk(f, b"IHDR", struct.pack(">IIBBBBB", width, width, 1, 0, 0, 0, 0))
+  compressor = zlib.compressobj(compression)
+  for row in get_packed_rows(qr, scale, border, invert=True): # in png gray, 1 is white
+    data = compressor.compress((b"\x00" + row) * scale) # every scanline uses filter type 0
+    if data:
+      write_png_chunk(f, b"IDAT", data)
+  write_png_chunk(f, b"IDAT", compressor.flush())
+  write_png_chunk(f, b"IEND", b"")
+
+WRITERS = {
+  "pbm": write_pbm,
+  "pgm": write_pgm,
+  "png": write_png,
+  "svg": svg.write_svg,
+}
+
+# writes qr to path, in the format given or else the one matching the file extension
+def save(qr, path, format=None, scale=4, border=4):
+  if format is None:
+    format = path.rsplit(".", 1)[-1].lower()
+  if format not in WRITERS:
+    raise ValueError("unknown image format %r" % format)
+  with open(path, "wb") as f:
+    WRITERS[format](qr, f, scale=scale, border=border)
@@ -0,0 +1,171 @@
+import asyncio
+import io
+import json
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+import backends
+import draw
+import qr
+import raster
+
+# every frame, request or response, is a 4 byte big-endian length followed by
+# that many bytes. requests are json objects:
+#   {"msg": "...", "level": "M", "format": "bits", "scale": 4, "border": 4}
+# where only msg is required. responses are a status byte, STATUS_OK or
+# STATUS_ERROR, followed by the symbol or a utf-8 error message. the "bits" format
+# is the symbol size as 2 bytes followed by the modules from QRMatrix.pack()
+FRAME_HEADER = struct.Struct(">I")
+BITS_HEADER = struct.Struct(">H")
+MAX_REQUEST_BYTES = 1 << 20
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+FORMATS = ("bits",) + tuple(raster.WRITERS)
+
+# runs in a worker process
+def render(msg, error_level="M", format="bits", scale=4, border=4):
+	symbol = qr.make_qr(msg, error_level=error_level)
+	if format == "bits":
+		return BITS_HEADER.pack(symbol.size) + symbol.pack()
+	f = io.BytesIO()
+	raster.WRITERS[format](symbol, f, scale=scale, border=border)
+	return f.getvalue()
+
+# loads numpy, if it is installed, and builds the templates of the smaller
+# versions up front, so the first requests a worker sees aren't slower than the rest
+def warm_worker():
+	backends.get_numpy_backend()
+	backends.get_backend(None, 1)
+	for version in range(1, 11):
+		draw.get_template(version)
+
+def parse_request(data):
+	request = json.loads(data)
+	if not isinstance(request, dict):
+		raise ValueError("request must be a json object")
+	if "msg" not in request:
+		raise ValueError("msg is required")
+	msg = request["msg"]
+	error_level = request.get("level", "M")
+	format = request.get("format", "bits")
+	scale = request.get("scale", 4)
+	border = request.get("border", 4)
+	for (name, value) in (("msg", msg), ("level", error_level), ("format", format)):
+		if not isinstance(value, str):
+			raise ValueError("%s must be a string" % name)
+	for (name, value) in (("scale", scale), ("border", border)):
+		if not isinstance(value, int) or isinstance(value, bool):
+			raise ValueError("%s must be an integer" % name)
+	if error_level not in qr.EC_TABLE:
+		raise ValueError("unknown error level %r" % error_level)
+	if format not in FORMATS:
+		raise ValueError("unknown format %r" % format)
+	if not 1 <= scale <= 64 or not 0 <= border <= 64:
+		raise ValueError("scale or border out of range")
+	return (msg, error_level, format, scale, border)
+
+async def read_frame(reader):
+	(length,) = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+	if length > MAX_REQUEST_BYTES:
+		raise ValueError("request of %d bytes is too large" % length)
+	return await reader.readexactly(length)
+
+def write_frame(writer, status, body):
+	writer.write(FRAME_HEADER.pack(len(body) + 1) + bytes([status]) + body)
+
+class Server:
+	"""Serves symbols from a pool of warm worker processes.
+
+	Requests identical to one already being worked on wait for its result
+	instead of being computed again. At most `max_queue` distinct requests
+	(four per worker by default) are handed to the pool at once; past that,
+	connections stop being read until a slot frees up, so a burst of clients
+	is slowed down rather than queued without limit.
+	"""
+	def __init__(self, workers=None, max_queue=None):
+		if workers is None:
+			workers = os.cpu_count() or 1
+		if max_queue is None:
+			max_queue = workers * 4
+		self.pool = ProcessPoolExecutor(max_workers=workers, initializer=warm_worker)
+		self.slots = asyncio.Semaphore(max_queue)
+		self.in_flight = {}
+		self.stats = {"requests": 0, "coalesced": 0, "errors": 0}
+
+	async def generate(self, key):
+		future = self.in_flight.get(key)
+		if future is not None:
+			self.stats["coalesced"] += 1
+			return await asyncio.shield(future)
+
+		loop = asyncio.get_running_loop()
+		future = loop.create_future()
+		self.in_flight[key] = future
+		try:
+			async with self.slots:
+				result = await loop.run_in_executor(self.pool, render, *key)
+			future.set_result(result)
+		except asyncio.CancelledError:
+			future.cancel()
+			raise
+		except Exception as e:
+			future.set_exception(e)
+		finally:
+			del self.in_flight[key]
+		return future.result()
+
+	# answers requests on one connection in order until the client hangs up
+	async def handle_connection(self, reader, writer):
+		try:
+			while True:
+				try:
+					data = await read_frame(reader)
+				except asyncio.IncompleteReadError:
+					break
+				self.stats["requests"] += 1
+				try:
+					body = await self.generate(parse_request(data))
+				except Exception as e: # bad requests, and anything going wrong in the pool
+					self.stats["errors"] += 1
+					write_frame(writer, STATUS_ERROR, (str(e) or type(e).__name__).encode("utf-8"))
+				else:
+					write_frame(writer, STATUS_OK, body)
+				await writer.drain()
+		except (ConnectionError, ValueError):
+			pass
+		finally:
+			writer.close()
+
+	# listens on the unix socket at path, or on host and port if no path is given
+	async def serve(self, path=None, host="127.0.0.1", port=8765):
+		if path is not None:
+			server = await asyncio.start_unix_server(self.handle_connection, path=path)
+		else:
+			server = await asyncio.start_server(self.handle_connection, host=host, port=port)
+		try:
+			async with server:
+				await server.serve_forever()
+		finally:
+			self.pool.shutdown(cancel_futures=True)
+
+def main():
+	import argparse
+	parser = argparse.ArgumentParser(description="serve qr codes over a unix socket or tcp")
+	parser.add_argument("--socket", help="unix socket path to listen on")
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8765)
+	parser.add_argument("--workers", type=int, help="worker processes, all cores by default")
+	parser.add_argument("--max-queue", type=int, help="requests handed to the workers at once")
+	args = parser.parse_args()
+
+	async def run():
+		server = Server(workers=args.workers, max_queue=args.max_queue)
+		await server.serve(path=args.socket, host=args.host, port=args.port)
+	try:
+		asyncio.run(run())
+	except KeyboardInterrupt:
+		pass
+
+if __name__ == "__main__":
+	main()
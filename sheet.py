@@ -0,0 +1,97 @@
+import mmap
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import backends
+import batch
+import qr
+import raster
+
+SHEET_FORMATS = ("pbm", "raw")
+
+class SheetLayout:
+  """A grid of `columns` by `rows` square tiles, each `tile` pixels wide.
+
+  The sheet is a 1 bit bitmap, 1 meaning dark, either as a pbm or as raw rows
+  with no header. Tiles are a whole number of bytes wide, so every symbol's
+  packed rows can be copied straight into place.
+  """
+  def __init__(self, columns, rows, tile, format="pbm"):
+    if tile % 8 != 0:
+      raise ValueError("tile width must be a multiple of 8 pixels")
+    if format not in SHEET_FORMATS:
+      raise ValueError("unknown sheet format %r" % format)
+    self.columns = columns
+    self.rows = rows
+    self.tile = tile
+    self.width = columns * tile
+    self.height = rows * tile
+    self.row_bytes = self.width // 8
+    self.header = b"P4\n%d %d\n" % (self.width, self.height) if format == "pbm" else b""
+
+  def __len__(self):
+    return self.columns * self.rows
+
+  def get_file_size(self):
+    return len(self.header) + self.row_bytes * self.height
+
+  # byte offset of pixel row y of the tile at index, counting across then down
+  def get_offset(self, index, y):
+    (tile_row, tile_column) = divmod(index, self.columns)
+    return len(self.header) + (tile_row*self.tile + y) * self.row_bytes + tile_column*self.tile//8
+
+# runs in a worker. encodes each (index, message) of the chunk and writes its rows
+# straight into the mapped sheet, which starts out all light
+def write_tiles(path, layout, chunk, error_level="M", scale=4, border=4):
+  backends.get_numpy_backend() # worth importing for a whole chunk, if it is installed
+  with open(path, "r+b") as f:
+    with mmap.mmap(f.fileno(), 0) as sheet:
+      for (index, message) in chunk:
+        (msg, level) = batch.split_request(message, error_level)
+        symbol = qr.make_qr(msg, error_level=level)
+        if raster.get_image_size(symbol, scale, border) > layout.tile:
+          raise ValueError("symbol %d is larger than a tile" % index)
+        offset = layout.get_offset(index, 0)
+        for row in raster.get_packed_rows(symbol, scale, border):
+          for _ in range(scale):
+            sheet[offset:offset+len(row)] = row
+            offset += layout.row_bytes
+  return len(chunk)
+
+def write_sheet(path, layout, messages, error_level="M", scale=4, border=4, workers=None, chunk_size=64, max_pending=None):
+  """Lays out one symbol per message on a sheet written to path.
+
+  The file is allocated at full size up front and memory mapped, and `workers`
+  processes (all cores by default) each map it too and write their symbols'
+  rows directly into their tiles, so no bitmap is ever held whole in memory.
+  Messages are taken as in batch.generate_many, and raise ValueError if there
+  are more than the layout has tiles. Returns the number of symbols written.
+  """
+  with open(path, "wb") as f:
+    f.write(layout.header)
+    f.truncate(layout.get_file_size())
+
+  if workers is None:
+    workers = os.cpu_count() or 1
+  if max_pending is None:
+    max_pending = workers * 2
+
+  def get_chunks():
+    for chunk in batch.chunked(enumerate(messages), chunk_size):
+      if chunk[-1][0] >= len(layout):
+        raise ValueError("more messages than the %d tiles on the sheet" % len(layout))
+      yield chunk
+
+  if workers == 1:
+    return sum(write_tiles(path, layout, chunk, error_level, scale, border) for chunk in get_chunks())
+
+  written = 0
+  with ProcessPoolExecutor(max_workers=workers) as pool:
+    pending = deque()
+    for chunk in get_chunks():
+      if len(pending) >= max_pending:
+        written += pending.popleft().result()
+      pending.append(pool.submit(write_tiles, path, layout, chunk, error_level, scale, border))
+    while pending:
+      written += pending.popleft().result()
+  return written
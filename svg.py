@@ -0,0 +1,40 @@
+import re
+import draw
+
+DARK_RUN = re.compile(b"\x01+")
+
+# yields the path data for the dark modules of qr, one row at a time. every
+# horizontal run of dark modules is a single rectangle, drawn relative to the
+# start of the one before it, so the path never repeats absolute coordinates
+def get_path_data(qr, border=4):
+  (last_x, last_y) = (0, 0)
+  first = True
+  for y in range(qr.size):
+    row = qr.row(y).tobytes().translate(draw.DARK_TABLE)
+    commands = []
+    for run in DARK_RUN.finditer(row):
+      x = run.start() + border
+      length = run.end() - run.start()
+      if first:
+        commands.append("M%d %d" % (x, y + border))
+        first = False
+      else:
+        commands.append("m%d %d" % (x - last_x, y + border - last_y))
+      commands.append("h%dv1h-%dz" % (length, length))
+      (last_x, last_y) = (x, y + border)
+    if commands:
+      yield "".join(commands)
+
+# writes qr as an svg document, one module to a unit of the view box. the quiet
+# zone is just the border of the view box, filled with light unless it is None
+def write_svg(qr, f, scale=4, border=4, dark="#000", light="#fff"):
+  width = qr.size + 2*border
+  f.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+  f.write(b'<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" viewBox="0 0 %d %d" shape-rendering="crispEdges">\n'
+    % (width*scale, width*scale, width, width))
+  if light is not None:
+    f.write(b'<rect width="100%%" height="100%%" fill="%s"/>\n' % light.encode("ascii"))
+  f.write(b'<path fill="%s" d="' % dark.encode("ascii"))
+  for data in get_path_data(qr, border):
+    f.write(data.encode("ascii"))
+  f.write(b'"/>\n</svg>\n')